@@ -0,0 +1,114 @@
+"""
+Scaling of segment_text_column from 100 to 100k segments
+
+    python -m benchmarks.bench_segmentation
+    python -m benchmarks.bench_segmentation --sizes 100 1000 10000 --legacy-max 10000
+"""
+import argparse
+import random
+import time
+import pandas as pd
+from tiktoken import get_encoding
+from utility import utility as util
+from utility import tokenization as tok
+
+WORDS = ("the group financial statements have been prepared in accordance with international financial reporting "
+         "standards as adopted by the european union audit opinion true and fair view revenue profit year ended").split()
+
+
+def synthetic_inputs(num_docs : int, tokens_per_doc : int, seed : int = 0) -> pd.DataFrame:
+    rng = random.Random(seed)
+    # roughly one token per word for this vocabulary
+    prompts = [" ".join(rng.choice(WORDS) for _ in range(tokens_per_doc)) for _ in range(num_docs)]
+    return pd.DataFrame({"filepath": [f"{i}.txt" for i in range(num_docs)],
+                         "filename": [f"{i}.txt" for i in range(num_docs)],
+                         "cc_iso3": "GBR",
+                         "prompt": prompts})
+
+
+# Previous implementations: the text is encoded once for counting and again for splitting, one pd.concat per
+# segment and every segment encoded again for its token count
+def legacy_count_tokens(text : str, encoding : str = "cl100k_base") -> int:
+    encoding = get_encoding(encoding)
+    return len(encoding.encode(text))
+
+
+def legacy_segment_text(text, max_tokens, overlay, encoding : str = "cl100k_base"):
+    tokens_ = 0
+    indexes = []
+    text_token_len = legacy_count_tokens(text)
+    while tokens_ + max_tokens <= text_token_len:
+        indexes.append((tokens_, max_tokens+tokens_))
+        tokens_ += max_tokens - overlay
+    indexes.append((tokens_, text_token_len))
+
+    encoder = get_encoding(encoding)
+    encoded_text = encoder.encode(text)
+
+    segments = [encoder.decode(encoded_text[index[0]:index[1]]) for index in indexes]
+
+    return segments
+
+
+def legacy_segment_text_column(raw_df, id_col, max_tokens, overlay, context_num_tokens, encoding):
+    result_df = pd.DataFrame()
+    raw_df = raw_df.copy()
+
+    for index in raw_df.index:
+        row = raw_df.loc[index].copy()
+        prompt = raw_df.loc[index]['prompt']
+        raw_df.drop(index, inplace = True)
+
+        segments = legacy_segment_text(prompt, max_tokens-context_num_tokens, overlay, encoding)
+
+        for i, s in enumerate(segments):
+            i_row = row.copy()
+            i_row["segment"] = str(i)
+            i_row["prompt"] = s
+            i_row = pd.DataFrame([i_row])
+            result_df = pd.concat([result_df, i_row], ignore_index=True)
+
+    result_df["prompt_tokens"] = result_df["prompt"].apply(legacy_count_tokens)
+    result_df["total_tokens"] = result_df["prompt_tokens"] + context_num_tokens
+
+    return result_df
+
+
+def timed(func, *args) -> tuple[float, int]:
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000, 100_000])
+    parser.add_argument("--segments-per-doc", type=int, default=10)
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--overlay", type=int, default=32)
+    parser.add_argument("--legacy-max", type=int, default=5_000, help="largest size the legacy version is run for")
+    parser.add_argument("--encoding", default="cl100k_base")
+    args = parser.parse_args()
+
+    tok.get_encoder(args.encoding)
+    step = args.max_tokens - args.overlay
+    rows = []
+    for size in args.sizes:
+        num_docs = max(1, size // args.segments_per_doc)
+        df = synthetic_inputs(num_docs, step * args.segments_per_doc)
+        new_time, num_segments = timed(util.segment_text_column, df, "filename", args.max_tokens, args.overlay, 0, args.encoding)
+        legacy_time = None
+        if size <= args.legacy_max:
+            legacy_time, _ = timed(legacy_segment_text_column, df, "filename", args.max_tokens, args.overlay, 0, args.encoding)
+        rows.append({"target": size,
+                     "segments": num_segments,
+                     "new (s)": round(new_time, 3),
+                     "legacy (s)": None if legacy_time is None else round(legacy_time, 3),
+                     "speedup": None if legacy_time is None else round(legacy_time / new_time, 1),
+                     "new segments/s": round(num_segments / new_time)})
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
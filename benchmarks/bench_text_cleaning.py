@@ -0,0 +1,84 @@
+"""
+Output equivalence and speed of clean_text against the previous implementation
+
+    python -m benchmarks.bench_text_cleaning                      # golden corpus: data/predict/*.txt
+    python -m benchmarks.bench_text_cleaning --corpus path/to/txt --profile
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+from utility import text_cleaning as tc
+from utility import utility as util
+
+FRAGMENTS = ["The financial statements have been prepared in accordance with IFRS.", "\n\n", "\x0c", "\xad",
+             "31 March 2006", "£1,234.5m", "(3)", " per cent ", " 12% ", " N/A ", " - ", "...", "\\", "www.example.com",
+             "https://example.com/report", "investor@example.com", "$ 2.5bn", " million ", " · ", "\t"]
+
+
+# Previous implementation: one uncompiled re.sub per rule
+def legacy_clean_text(text) -> str:
+    text = re.sub(r'[\x0c\xad]', ' ', text)
+    text = re.sub(r'\n\s*\n*', ' ', text)
+    text = re.sub(r'http[s]?://[^\s]+|www\.[^\s]+', ' ', text)
+    text = re.sub(r'\b\d{1,2} [a-zA-Z]+ \d{4}\b', ' ', text)
+    text = re.sub(r'[$€£¥₹₽₩₺₴₭₪₨]', " ", text)
+    text = re.sub(r'\b[(]?(\d{1,3},)*\d{0,3}.\d+[pkKmMbB)]?\b', ' ', text)
+    text = re.sub(r'\(\s*\d*[a-zA-Z]?\+?\s*\)', ' ', text)
+    text = re.sub(r"\s{1,}(\(?\d{0,2}%[),]?|\'|N/A|\(|p|per cent|\*|·|million|,|\.|-|:)\s{1,}", ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = re.sub(r'\.{2,}', r"\\.", text)
+    text = re.sub(r'[\\]', '', text)
+    text = re.sub(r'\S+@\S+', '', text)
+    return text
+
+
+def synthetic_corpus(num_docs : int, num_fragments : int, seed : int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(FRAGMENTS) + rng.choice([" ", "", "\n"]) for _ in range(num_fragments)) for _ in range(num_docs)]
+
+
+def load_corpus(path : str) -> list[str]:
+    texts = [util.parse_txt(file) for file in sorted(glob.glob(os.path.join(path, "*.txt")))]
+    return [t for t in texts if t is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join("data", "predict"))
+    parser.add_argument("--synthetic-docs", type=int, default=50, help="used when the corpus directory is empty")
+    parser.add_argument("--profile", action="store_true", help="print time spent per cleaning step")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus) if os.path.isdir(args.corpus) else []
+    if not texts:
+        print(f"No documents in {args.corpus}, using {args.synthetic_docs} synthetic documents")
+        texts = synthetic_corpus(args.synthetic_docs, 20_000)
+    size = sum(len(t) for t in texts) / 1e6
+
+    start = time.perf_counter()
+    reference = [legacy_clean_text(t) for t in texts]
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cleaned = [tc.clean_text(t) for t in texts]
+    cleaned_time = time.perf_counter() - start
+
+    mismatches = [i for i, (a, b) in enumerate(zip(reference, cleaned)) if a != b]
+    print(f"documents: {len(texts)}, {size:.1f}M characters")
+    print(f"legacy:     {reference_time:.3f}s ({size / reference_time:.1f}M chars/s)")
+    print(f"clean_text: {cleaned_time:.3f}s ({size / cleaned_time:.1f}M chars/s)")
+    print(f"mismatches: {len(mismatches)}")
+
+    if args.profile:
+        print(tc.profile_clean_text(texts).to_string())
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
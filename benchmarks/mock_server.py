@@ -0,0 +1,172 @@
+"""
+Local OpenAI compatible chat completions server for benchmarks
+
+    python -m benchmarks.mock_server --port 8000 --latency 0.5 --error-rate 0.01 --rpm 3000
+    client = OpenAI(base_url="http://127.0.0.1:8000/v1", api_key="mock", max_retries=0)
+
+Answers with the standards found by benchmarks.synthetic's patterns in the last user message.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .synthetic import AUDIT_PATTERN, NOTES_PATTERN
+
+
+def _answer(prompt : str) -> dict:
+    answer = {}
+    for source, pattern in [("notes", NOTES_PATTERN), ("audit", AUDIT_PATTERN)]:
+        match = pattern.search(prompt)
+        answer[source] = {"sentence": match.group(0) if match else "", "term": match.group(1) if match else ""}
+    return answer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server : "MockServer"
+    # keep connections alive, a new connection per request adds connect latency to every call
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status : int, body : dict, headers : dict = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+        status = self.server.admit()
+        if status == 429:
+            return self._send(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                              {"Retry-After": "1"})
+        if status == 500:
+            return self._send(500, {"error": {"message": "The server had an error", "type": "server_error"}})
+
+        messages = request.get("messages", [])
+        prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        content = json.dumps(_answer(prompt))
+        # about four characters per token
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        time.sleep(self.server.sample_latency(completion_tokens))
+        self._send(200, {"id": f"chatcmpl-mock{self.server.next_id()}",
+                         "object": "chat.completion",
+                         "created": int(time.time()),
+                         "model": request.get("model", "mock"),
+                         "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                                      "message": {"role": "assistant", "content": content}}],
+                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                   "total_tokens": prompt_tokens + completion_tokens}})
+
+
+# Threaded server answering /v1/chat/completions with configurable latency, errors and rate limiting
+class MockServer(ThreadingHTTPServer):
+    """
+    # Behaviour
+        - latency: seconds per request plus per_output_token per completion token, jittered by +- jitter seconds
+        - error_rate: share of requests answered with 500
+        - rate_limit_rate: share of requests answered with 429
+        - rpm: requests above rpm within the last 60 seconds are answered with 429
+    """
+    daemon_threads = True
+    # listen backlog, socketserver's default of 5 drops connections of more concurrent clients (retried after ~1s)
+    request_queue_size = 128
+
+    def __init__(self, host : str = "127.0.0.1", port : int = 0, latency : float = 0.05, jitter : float = 0.02,
+                 per_output_token : float = 0.0, error_rate : float = 0.0, rate_limit_rate : float = 0.0, rpm : int = None,
+                 seed : int = 0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.per_output_token = per_output_token
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.admitted = deque()
+        self.counts = {200: 0, 429: 0, 500: 0}
+        self.ids = 0
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def admit(self) -> int:
+        with self.lock:
+            now = time.monotonic()
+            while self.admitted and now - self.admitted[0] > 60:
+                self.admitted.popleft()
+            if (self.rpm and len(self.admitted) >= self.rpm) or self.rng.random() < self.rate_limit_rate:
+                status = 429
+            elif self.rng.random() < self.error_rate:
+                status = 500
+            else:
+                status = 200
+                self.admitted.append(now)
+            self.counts[status] += 1
+            return status
+
+    def sample_latency(self, completion_tokens : int) -> float:
+        with self.lock:
+            jitter = self.rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.latency + self.per_output_token * completion_tokens + jitter)
+
+    def next_id(self) -> int:
+        with self.lock:
+            self.ids += 1
+            return self.ids
+
+    def start(self) -> "MockServer":
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--per-output-token", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, args.latency, args.jitter, args.per_output_token, args.error_rate,
+                        args.rate_limit_rate, args.rpm)
+    print(f"Serving chat completions at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
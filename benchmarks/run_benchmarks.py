@@ -0,0 +1,169 @@
+"""
+Throughput, latency and memory of the pipeline on synthetic statements, inference against the local mock server
+
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json          # exits 1 on regressions
+    python -m benchmarks.run_benchmarks --docs 200 --size-kb 300 --latency 0.2 --error-rate 0.02 --rpm 600
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+from openai import OpenAI
+from utility import inference
+from utility import results
+from utility import telemetry
+from utility import text_cleaning as tc
+from utility import tokenization as tok
+from utility import utility as util
+from .mock_server import MockServer
+from .synthetic import write_filings
+
+COI = ["filepath", "filename"]
+
+
+# Result, seconds and peak traced memory in MB (of a second, traced run) of func(*args, **kwargs)
+def measure(func, *args, memory : bool = True, **kwargs) -> tuple[object, float, float]:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_preprocessing(files : pd.DataFrame, args) -> tuple[dict, pd.DataFrame]:
+    texts = [util.parse_txt(path) for path in files["filepath"]]
+    chars = sum(len(t) for t in texts) / 1e6
+    report = {}
+
+    _, seconds, peak = measure(lambda: [tc.clean_text(t) for t in texts], memory=args.memory)
+    report["clean_text"] = {"seconds": seconds, "MB/s": chars / seconds, "peak MB": peak}
+
+    prep_args = (files, "filepath", "filename", COI, args.base_tokens, False, args.max_tokens, args.overlay, args.encoding,
+                 args.workers, args.chunk_size)
+    documents, seconds, peak = measure(util.prep_inputs, *prep_args, memory=args.memory)
+    report["prep_inputs"] = {"seconds": seconds, "docs/s": len(files) / seconds, "MB/s": chars / seconds, "peak MB": peak}
+
+    segments, seconds, peak = measure(util.segment_text_column, documents, "filename", args.max_tokens, args.overlay,
+                                      args.base_tokens, args.encoding, memory=args.memory)
+    report["segment_text_column"] = {"seconds": seconds, "segments/s": len(segments) / seconds, "peak MB": peak}
+
+    segmented_args = prep_args[:5] + (True,) + prep_args[6:]
+    _, seconds, peak = measure(util.prep_inputs, *segmented_args, memory=args.memory)
+    report["prep_inputs (segmented)"] = {"seconds": seconds, "docs/s": len(files) / seconds, "MB/s": chars / seconds, "peak MB": peak}
+    return report, segments
+
+
+def bench_inference(segments : pd.DataFrame, args) -> dict:
+    segments = segments.head(args.requests)
+    server = MockServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate, rpm=args.rpm)
+    recorder = telemetry.enable()
+    try:
+        with server:
+            client = OpenAI(base_url=server.url, api_key="mock", max_retries=0)
+            start = time.perf_counter()
+            outputs = inference.prompt_gpt_df(client, "Extract the accounting standards.", segments, max_workers=args.max_workers,
+                                              rpm=1_000_000, tpm=1_000_000_000, progress=False, compact=True)
+            seconds = time.perf_counter() - start
+    finally:
+        telemetry.disable()
+
+    telemetry_report = recorder.report()
+    calls, retries = telemetry_report["calls"], telemetry_report["retries"]
+    return {"inference": {"seconds": seconds,
+                          "requests/s": len(segments) / seconds,
+                          "tokens/s": (calls["prompt_tokens"] + calls["completion_tokens"]) / seconds,
+                          "latency p50": calls["latency_p50"],
+                          "latency p95": calls["latency_p95"],
+                          "retries rate_limit": retries.get("rate_limit", {}).get("count", 0),
+                          "retries server_error": retries.get("server_error", {}).get("count", 0),
+                          "malformed": results.count_malformed(pd.DataFrame({"output": outputs}))}}
+
+
+# Metrics compared against a baseline and whether higher values are better
+def _direction(metric : str) -> bool:
+    if metric.endswith("/s"):
+        return True
+    if metric in ("seconds", "peak MB") or metric.startswith("latency"):
+        return False
+    return None
+
+
+def compare(report : dict, baseline : dict, tolerance : float) -> pd.DataFrame:
+    rows = []
+    for stage, metrics in report.items():
+        for metric, value in metrics.items():
+            reference = baseline.get(stage, {}).get(metric)
+            higher_is_better = _direction(metric)
+            if higher_is_better is None or value is None or not reference:
+                continue
+            change = value / reference - 1
+            regression = change < -tolerance if higher_is_better else change > tolerance
+            rows.append({"stage": stage, "metric": metric, "baseline": reference, "current": value,
+                         "change %": round(change * 100, 1), "regression": regression})
+    return pd.DataFrame(rows, columns=["stage", "metric", "baseline", "current", "change %", "regression"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--size-kb", type=float, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--encoding", default="cl100k_base")
+    parser.add_argument("--max-tokens", type=int, default=4_000)
+    parser.add_argument("--base-tokens", type=int, default=1_000)
+    parser.add_argument("--overlay", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=None, help="prep_inputs processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the traced runs for peak memory")
+    parser.add_argument("--requests", type=int, default=500, help="segments sent to the mock server")
+    parser.add_argument("--max-workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=None, help="rate limit of the mock server")
+    parser.add_argument("--skip-inference", action="store_true")
+    parser.add_argument("--output", help="write the results as json")
+    parser.add_argument("--save-baseline", help="write the results as baseline json")
+    parser.add_argument("--baseline", help="compare against a baseline json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative change counted as regression")
+    args = parser.parse_args()
+
+    tok.get_encoder(args.encoding)
+    with tempfile.TemporaryDirectory() as directory:
+        files = write_filings(directory, args.docs, args.size_kb, args.seed)
+        report, segments = bench_preprocessing(files, args)
+    if not args.skip_inference:
+        report.update(bench_inference(segments, args))
+
+    print(pd.DataFrame(report).T.round(3).to_string())
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "save_baseline", "baseline", "tolerance")}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                json.dump({"config": config, **report}, file, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("config") != config:
+            print(f"Warning: {args.baseline} was recorded with a different configuration")
+        comparison = compare(report, baseline, args.tolerance)
+        print(comparison.to_string(index=False))
+        if comparison["regression"].any():
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
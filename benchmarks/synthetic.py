@@ -0,0 +1,88 @@
+"""
+Synthetic financial statements with known auditor and notes standards
+
+    python -m benchmarks.synthetic --out data/synthetic --docs 100 --size-kb 200
+"""
+import argparse
+import os
+import random
+import re
+import pandas as pd
+
+STANDARDS = ["IFRS as adopted by the European Union", "International Financial Reporting Standards",
+             "United Kingdom Generally Accepted Accounting Practice", "FRS 102", "US GAAP", "the Companies Act 2006"]
+
+NOTES_TEMPLATE = "The financial statements have been prepared in accordance with {standard} and under the historical cost convention."
+AUDIT_TEMPLATE = "In our opinion the financial statements have been properly prepared in accordance with {standard}."
+
+# Used by the mock server to answer like the model would
+NOTES_PATTERN = re.compile(r"The financial statements have been prepared in accordance with (.+?) and under")
+AUDIT_PATTERN = re.compile(r"In our opinion the financial statements have been properly prepared in accordance with (.+?)\.")
+
+SENTENCES = ["Revenue for the year ended {date} increased by {pct} to £{amount}m.",
+             "The directors present their annual report on the affairs of the group.",
+             "Operating profit was £{amount}m ({amount}m in the prior year).",
+             "Further information is available at www.example-plc.com/investors or from ir@example-plc.com.",
+             "The group's principal risks are set out on page {page}.",
+             "Trade and other receivables are measured at amortised cost using the effective interest method.",
+             "Deferred tax is recognised on temporary differences at the rates expected to apply.",
+             "Goodwill is tested for impairment annually and whenever there is an indication of impairment.",
+             "The board considers the annual report, taken as a whole, to be fair, balanced and understandable.",
+             "Note {page}: Property, plant and equipment . . . . . {amount}",
+             "\x0cPage {page}\n\n",
+             "Dividends of {pence}p per share ({pct} of earnings) were paid during the year."]
+
+
+def _sentence(rng : random.Random) -> str:
+    return rng.choice(SENTENCES).format(date=f"{rng.randint(1, 28)} March {rng.randint(2000, 2023)}",
+                                        pct=f"{rng.randint(1, 40)}.{rng.randint(0, 9)}%",
+                                        amount=f"{rng.randint(1, 999)},{rng.randint(100, 999)}.{rng.randint(0, 9)}",
+                                        page=rng.randint(1, 200),
+                                        pence=rng.randint(1, 99))
+
+
+# Statement of roughly size_kb kilobytes, the notes standard about a quarter in and the auditor's report near the end
+def synthetic_filing(rng : random.Random, size_kb : float, notes_standard : str, audit_standard : str) -> str:
+    sentences = []
+    size = 0
+    while size < size_kb * 1000:
+        sentence = _sentence(rng)
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    sentences.insert(int(len(sentences) * 0.85), AUDIT_TEMPLATE.format(standard=audit_standard))
+    sentences.insert(int(len(sentences) * 0.25), NOTES_TEMPLATE.format(standard=notes_standard))
+    return " ".join(sentences)
+
+
+# Write num_docs statements to out_dir, returns one row per file with the standards it contains
+def write_filings(out_dir : str, num_docs : int, size_kb : float, seed : int = 0) -> pd.DataFrame:
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    rows = []
+    for i in range(num_docs):
+        filename = f"synthetic_{i:06d}.txt"
+        notes, audit = rng.choice(STANDARDS), rng.choice(STANDARDS)
+        # sizes vary around size_kb like real filings do
+        text = synthetic_filing(rng, size_kb * rng.uniform(0.5, 1.5), notes, audit)
+        with open(os.path.join(out_dir, filename), "w", encoding="utf-8") as file:
+            file.write(text)
+        rows.append({"filepath": os.path.join(out_dir, filename), "filename": filename,
+                     "notes_standard": notes, "audit_standard": audit})
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=os.path.join("data", "synthetic"))
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--size-kb", type=float, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    files = write_filings(args.out, args.docs, args.size_kb, args.seed)
+    files.to_csv(os.path.join(args.out, "labels.csv"), index=False)
+    print(f"{len(files)} statements written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
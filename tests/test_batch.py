@@ -0,0 +1,78 @@
+import json
+import os
+import pandas as pd
+import pytest
+from utility import batch
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+@pytest.fixture
+def df_inputs():
+    return pd.DataFrame({"filename": ["a.txt", "a.txt", "b.txt", "c.txt"],
+                         "segment": [0, 1, 0, 0],
+                         "prompt": ["first", "second", "third", "fourth"]})
+
+
+def read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_custom_ids_are_stable_and_unique(df_inputs):
+    assert batch.batch_custom_ids(df_inputs).tolist() == ["a.txt::0", "a.txt::1", "b.txt::0", "c.txt::0"]
+    assert batch.batch_custom_ids(df_inputs.drop(columns="segment").iloc[[0, 2]]).tolist() == ["a.txt", "b.txt"]
+    with pytest.raises(ValueError):
+        batch.batch_custom_ids(pd.concat([df_inputs, df_inputs]))
+
+
+def test_write_batch_requests(df_inputs, tmp_path):
+    paths = batch.write_batch_requests(df_inputs, str(tmp_path), "system", [("user", "assistant")], "gpt-3.5-turbo-0125")
+    requests = read_jsonl(paths[0])
+    assert len(paths) == 1 and len(requests) == 4
+    assert requests[1]["custom_id"] == "a.txt::1"
+    assert requests[1]["url"] == "/v1/chat/completions"
+    assert requests[1]["body"]["model"] == "gpt-3.5-turbo-0125"
+    assert [m["role"] for m in requests[1]["body"]["messages"]] == ["system", "user", "assistant", "user"]
+    assert requests[1]["body"]["messages"][-1]["content"] == "second"
+
+
+def test_write_batch_requests_columns(df_inputs, tmp_path):
+    df = df_inputs.rename(columns={"filename": "doc", "segment": "part", "prompt": "text"})
+    paths = batch.write_batch_requests(df, str(tmp_path), "system", id_col="doc", segment_col="part", prompt_col="text")
+    requests = read_jsonl(paths[0])
+    assert [r["custom_id"] for r in requests] == ["a.txt::0", "a.txt::1", "b.txt::0", "c.txt::0"]
+    assert requests[2]["body"]["messages"][-1]["content"] == "third"
+
+
+def test_write_batch_files_splits_by_limits(df_inputs, tmp_path):
+    requests = batch.create_batch_requests(df_inputs, "system")
+    paths = batch.write_batch_files(requests, str(tmp_path), max_requests=3)
+    assert [len(read_jsonl(p)) for p in paths] == [3, 1]
+
+    size = len((json.dumps(requests[0]) + "\n").encode("utf-8"))
+    paths = batch.write_batch_files(requests, str(tmp_path / "bytes"), max_bytes=2 * size + 1)
+    assert [len(read_jsonl(p)) for p in paths] == [2, 2]
+    with pytest.raises(ValueError):
+        batch.write_batch_files(requests, str(tmp_path / "small"), max_bytes=size - 1)
+
+
+def test_read_batch_results():
+    results = batch.read_batch_results(os.path.join(FIXTURES, "batch_output.jsonl"))
+    assert sorted(results.index) == ["a.txt::0", "a.txt::1", "b.txt::0"]
+    # the retried request of a.txt::1 replaces its failed attempt
+    assert results.loc["a.txt::1", "status_code"] == 200
+    assert results.loc["a.txt::1", "error"] is None
+    assert "UK GAAP" in results.loc["a.txt::1", "output"].choices[0].message.content
+    assert results.loc["b.txt::0", "output"] is None
+    assert results.loc["b.txt::0", "error"]["code"] == "batch_expired"
+
+
+def test_merge_batch_results(df_inputs):
+    results = batch.read_batch_results([os.path.join(FIXTURES, "batch_output.jsonl")])
+    merged = batch.merge_batch_results(df_inputs, results)
+    assert merged.loc[0, "output"].usage.prompt_tokens == 1200
+    assert merged.loc[1, "output"] is not None
+    assert merged.loc[2, "output"] is None or pd.isna(merged.loc[2, "output"])
+    assert merged.loc[3, "batch_error"] == "missing"
+    assert "output" not in df_inputs.columns
@@ -0,0 +1,54 @@
+import json
+import pandas as pd
+import pytest
+import tiktoken
+from utility import tokenization as tok
+from utility import utility as util
+
+ENCODING = "test_bytes"
+
+
+# Byte level encoding, the tests do not depend on downloading a tiktoken encoding
+@pytest.fixture(autouse=True)
+def byte_encoding(monkeypatch):
+    encoding = tiktoken.Encoding(name=ENCODING, pat_str=r"\S+|\s+", mergeable_ranks={bytes([i]): i for i in range(256)},
+                                 special_tokens={})
+    monkeypatch.setattr(tok, "get_encoding", lambda name: encoding)
+    tok.get_encoder.cache_clear()
+    yield
+    tok.get_encoder.cache_clear()
+
+
+@pytest.fixture
+def df_inputs(tmp_path):
+    for name, text in [("a.txt", "The financial statements are prepared under IFRS. " * 20),
+                       ("b.txt", "Prepared in accordance with UK GAAP including FRS 102. " * 5)]:
+        (tmp_path / name).write_text(text)
+    raw = pd.DataFrame({"filepath": [str(tmp_path / n) for n in ("a.txt", "b.txt")],
+                        "filename": ["a.txt", "b.txt"],
+                        "cc_iso3": ["GBR", "GBR"]})
+    return util.prep_inputs(raw, "filepath", "filename", ["filepath", "filename", "cc_iso3"], 100, True, 400, 20,
+                            ENCODING, num_workers=1)
+
+
+def test_export_outputs(df_inputs, tmp_path):
+    assert "prompt_tokens" in df_inputs.columns and len(df_inputs) > 2
+    df = df_inputs.copy()
+    df["output"] = [{"content": json.dumps({"notes": {"term": "IFRS"}}), "finish_reason": "stop", "prompt_tokens": 500,
+                     "completion_tokens": 12, "latency": 0.5, "model": "gpt-3.5-turbo-0125"}] * (len(df) - 1) + [None]
+
+    path = tmp_path / "outputs.parquet"
+    util.export_outputs(df, str(path))
+    exported = pd.read_parquet(path)
+
+    assert exported["prompt_tokens"].tolist() == df_inputs["prompt_tokens"].tolist()
+    assert exported["output_prompt_tokens"].iloc[0] == 500
+    assert exported["output_model"].iloc[0] == "gpt-3.5-turbo-0125"
+    assert pd.isna(exported["output_content"].iloc[-1])
+    assert "output" not in exported.columns
+
+
+def test_export_outputs_without_output(df_inputs, tmp_path):
+    path = tmp_path / "inputs.parquet"
+    util.export_outputs(df_inputs, str(path))
+    assert pd.read_parquet(path).columns.tolist() == df_inputs.columns.tolist()
@@ -0,0 +1,122 @@
+import json
+import os
+import pandas as pd
+from openai.types.chat import ChatCompletion
+from . import utility as util
+
+# Batch API input file limits
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_BYTES = 100 * 1024 * 1024
+
+
+# Stable request ids derived from filename and segment
+def make_custom_id(filename : str, segment = None) -> str:
+    if segment is None or pd.isna(segment):
+        return str(filename)
+    return f"{filename}::{segment}"
+
+
+def batch_custom_ids(df : pd.DataFrame, id_col : str = "filename", segment_col : str = "segment") -> pd.Series:
+    if segment_col in df.columns:
+        ids = [make_custom_id(f, s) for f, s in zip(df[id_col], df[segment_col])]
+    else:
+        ids = [make_custom_id(f) for f in df[id_col]]
+    ids = pd.Series(ids, index=df.index)
+    if ids.duplicated().any():
+        raise ValueError(f"Duplicate custom ids: {ids[ids.duplicated()].unique()[:5].tolist()}")
+    return ids
+
+
+# Serialize each row of df_inputs as a chat completion request
+def create_batch_requests(df : pd.DataFrame,
+                          system : str,
+                          user_assistant : list[tuple[str,str]] = None,
+                          model : str = "gpt-3.5-turbo-0125",
+                          temp = 0,
+                          id_col : str = "filename",
+                          segment_col : str = "segment",
+                          prompt_col : str = "prompt") -> list[dict]:
+    requests = []
+    for custom_id, prompt in zip(batch_custom_ids(df, id_col, segment_col), df[prompt_col]):
+        messages = util.create_messages_context_gpt(system, prompt, user_assistant)
+        requests.append({"custom_id": custom_id,
+                         "method": "POST",
+                         "url": "/v1/chat/completions",
+                         "body": {"model": model, "messages": messages, "temperature": temp}})
+    return requests
+
+
+# Write requests to jsonl files, starting a new file once a request or byte limit would be exceeded
+def write_batch_files(requests : list[dict],
+                      out_dir : str,
+                      prefix : str = "batch_requests",
+                      max_requests : int = MAX_BATCH_REQUESTS,
+                      max_bytes : int = MAX_BATCH_BYTES) -> list[str]:
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    file = None
+    num_requests = num_bytes = 0
+
+    try:
+        for request in requests:
+            line = (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+            if len(line) > max_bytes:
+                raise ValueError(f"Request {request['custom_id']} exceeds max_bytes ({len(line)} > {max_bytes})")
+            if file is None or num_requests >= max_requests or num_bytes + len(line) > max_bytes:
+                if file is not None:
+                    file.close()
+                paths.append(os.path.join(out_dir, f"{prefix}_{len(paths):03d}.jsonl"))
+                file = open(paths[-1], "wb")
+                num_requests = num_bytes = 0
+            file.write(line)
+            num_requests += 1
+            num_bytes += len(line)
+    finally:
+        if file is not None:
+            file.close()
+
+    return paths
+
+
+def write_batch_requests(df : pd.DataFrame, out_dir : str, system : str, user_assistant : list[tuple[str,str]] = None,
+                         model : str = "gpt-3.5-turbo-0125", temp = 0, id_col : str = "filename", segment_col : str = "segment",
+                         prompt_col : str = "prompt", **kwargs) -> list[str]:
+    requests = create_batch_requests(df, system, user_assistant, model, temp, id_col, segment_col, prompt_col)
+    return write_batch_files(requests, out_dir, **kwargs)
+
+
+# Read batch output files into a dataframe indexed by custom id
+def read_batch_results(paths : list[str]) -> pd.DataFrame:
+    if isinstance(paths, str):
+        paths = [paths]
+
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                body = response.get("body")
+                status_code = response.get("status_code")
+                output = None
+                if status_code == 200 and body:
+                    output = ChatCompletion.model_validate(body)
+                records.append({"custom_id": result["custom_id"],
+                                "status_code": status_code,
+                                "output": output,
+                                "error": result.get("error") or (body.get("error") if body and output is None else None)})
+
+    results = pd.DataFrame.from_records(records, columns=["custom_id", "status_code", "output", "error"])
+    return results.drop_duplicates("custom_id", keep="last").set_index("custom_id")
+
+
+# Attach batch outputs to the rows of df_inputs they were created from
+def merge_batch_results(df : pd.DataFrame, results : pd.DataFrame, id_col : str = "filename", segment_col : str = "segment") -> pd.DataFrame:
+    df = df.copy()
+    ids = batch_custom_ids(df, id_col, segment_col)
+    df["output"] = ids.map(results["output"]).astype(object)
+    df["batch_error"] = ids.map(results["error"]).astype(object)
+    df.loc[~ids.isin(results.index), "batch_error"] = "missing"
+    return df
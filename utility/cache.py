@@ -0,0 +1,107 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from openai.types.chat import ChatCompletion
+
+
+# Persistent cache for chat completions keyed by model, messages and temperature
+class ResponseCache:
+    """
+    # Storage
+        - responses are stored as json in a single SQLite file, keyed by the sha256 of the exact request
+        - entries older than max_age (seconds) are treated as misses and removed on evict()
+        - evict() keeps the most recently accessed entries within max_entries / max_bytes
+    """
+
+    def __init__(self, path : str, max_entries : int = None, max_bytes : int = None, max_age : float = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created REAL,
+                accessed REAL)
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(model : str, messages : list[dict[str,str]], temp) -> str:
+        request = json.dumps({"model": model, "messages": messages, "temperature": temp},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def get(self, key : str) -> ChatCompletion:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return ChatCompletion.model_validate_json(row[0])
+
+    def put(self, key : str, model : str, response : ChatCompletion):
+        data = response.model_dump_json()
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, model, data, len(data), now, now))
+            self.conn.commit()
+
+    def evict(self) -> int:
+        with self.lock:
+            before = self.conn.total_changes
+            if self.max_age is not None:
+                self.conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+            if self.max_entries is not None:
+                self.conn.execute("""
+                    DELETE FROM responses WHERE key NOT IN (
+                        SELECT key FROM responses ORDER BY accessed DESC LIMIT ?)
+                """, (self.max_entries,))
+            if self.max_bytes is not None:
+                self.conn.execute("""
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (ORDER BY accessed DESC, key) AS total FROM responses)
+                        WHERE total > ?)
+                """, (self.max_bytes,))
+            self.conn.commit()
+            return self.conn.total_changes - before
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        requests = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "entries": entries,
+                "bytes": size}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
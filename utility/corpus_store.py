@@ -0,0 +1,188 @@
+import hashlib
+import inspect
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import tiktoken
+from . import ingestion
+from . import text_cleaning as tc
+from . import tokenization as tok
+from . import utility as util
+
+# Bumped when stored documents or segments change in ways the module sources below do not capture
+STORE_VERSION = 2
+
+DOCUMENT_SCHEMA = pa.schema([("file_hash", pa.string()),
+                             ("status", pa.string()),
+                             ("prompt", pa.large_string()),
+                             ("prompt_tokens", pa.int64())])
+
+SEGMENT_SCHEMA = pa.schema([("file_hash", pa.string()),
+                            ("segment", pa.int64()),
+                            ("prompt", pa.large_string()),
+                            ("prompt_tokens", pa.int64()),
+                            ("token_start", pa.int64()),
+                            ("token_end", pa.int64()),
+                            ("char_start", pa.int64()),
+                            ("char_end", pa.int64())])
+
+SEGMENT_COLUMNS = ["segment", "token_start", "token_end", "char_start", "char_end"]
+
+
+# Content hash of a file, None for files that do not exist
+def hash_file(file_path : str, block_size : int = 1 << 20) -> str:
+    if not os.path.isfile(file_path):
+        return None
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_files(file_paths : list[str], num_threads : int = 8) -> list[str]:
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(executor.map(hash_file, file_paths))
+
+
+# Any change to reading, cleaning or tokenization (or the tiktoken version) invalidates stored documents
+def preprocessing_fingerprint() -> str:
+    digest = hashlib.sha256(f"{STORE_VERSION} {tiktoken.__version__}".encode("utf-8"))
+    for module in (ingestion, tc, tok):
+        digest.update(inspect.getsource(module).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _params_key(params : dict) -> str:
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+# Parquet store of cleaned documents and segment tables keyed by file hash and preprocessing parameters
+class CorpusStore:
+    """
+    # Layout
+        <path>/documents/<key>/part-*.parquet   file_hash, status, prompt, prompt_tokens
+                                                (empty and undecodable files are kept with their status only)
+        <path>/segments/<key>/part-*.parquet    file_hash, segment, prompt, prompt_tokens, token/char offsets
+        each <key> directory holds a params.json with the parameters the key was derived from,
+        new results are appended as additional parts, compact() merges them into one file
+    """
+
+    def __init__(self, path : str):
+        self.path = path
+
+    def document_params(self, encoding : str) -> dict:
+        return {"encoding": encoding, "preprocessing": preprocessing_fingerprint()}
+
+    def segment_params(self, encoding : str, max_tokens : int, overlay : int) -> dict:
+        return {**self.document_params(encoding), "max_tokens": max_tokens, "overlay": overlay}
+
+    def _dir(self, kind : str, params : dict) -> str:
+        path = os.path.join(self.path, kind, _params_key(params))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            with open(os.path.join(path, "params.json"), "w") as file:
+                json.dump(params, file, indent=1)
+        return path
+
+    def _read(self, kind : str, params : dict, schema : pa.Schema, file_hashes : list[str] = None) -> pd.DataFrame:
+        path = self._dir(kind, params)
+        parts = sorted(f for f in os.listdir(path) if f.endswith(".parquet"))
+        if not parts:
+            return schema.empty_table().to_pandas()
+        filters = [("file_hash", "in", list(set(file_hashes)))] if file_hashes is not None else None
+        table = pq.read_table([os.path.join(path, f) for f in parts], schema=schema, memory_map=True, filters=filters)
+        return table.to_pandas()
+
+    def _append(self, kind : str, params : dict, schema : pa.Schema, df : pd.DataFrame):
+        if df.empty:
+            return
+        table = pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+        pq.write_table(table, os.path.join(self._dir(kind, params), f"part-{uuid.uuid4().hex}.parquet"))
+
+    def load_documents(self, encoding : str = "cl100k_base", file_hashes : list[str] = None) -> pd.DataFrame:
+        return self._read("documents", self.document_params(encoding), DOCUMENT_SCHEMA, file_hashes)
+
+    def load_segments(self, encoding : str, max_tokens : int, overlay : int, file_hashes : list[str] = None) -> pd.DataFrame:
+        return self._read("segments", self.segment_params(encoding, max_tokens, overlay), SEGMENT_SCHEMA, file_hashes)
+
+    def append_documents(self, df : pd.DataFrame, encoding : str = "cl100k_base"):
+        self._append("documents", self.document_params(encoding), DOCUMENT_SCHEMA, df)
+
+    def append_segments(self, df : pd.DataFrame, encoding : str, max_tokens : int, overlay : int):
+        self._append("segments", self.segment_params(encoding, max_tokens, overlay), SEGMENT_SCHEMA, df)
+
+    # Merge the parts of every key into a single file
+    def compact(self):
+        for kind, schema in [("documents", DOCUMENT_SCHEMA), ("segments", SEGMENT_SCHEMA)]:
+            kind_path = os.path.join(self.path, kind)
+            if not os.path.isdir(kind_path):
+                continue
+            for key in os.listdir(kind_path):
+                path = os.path.join(kind_path, key)
+                parts = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".parquet"))
+                if len(parts) <= 1:
+                    continue
+                table = pq.read_table(parts, schema=schema)
+                pq.write_table(table, os.path.join(path, f"part-{uuid.uuid4().hex}.parquet"))
+                for part in parts:
+                    os.remove(part)
+
+
+# prep_inputs backed by a CorpusStore, only new or modified files are read, cleaned and segmented
+# (files found empty or undecodable are not read again, they are counted by status on every run)
+def prep_inputs_cached(store : CorpusStore, raw_df, filepath_col, id_col, coi, base_token_length, flag_segment, max_token_num, overlay,
+                       encoding = "cl100k_base", num_workers = None, chunk_size = 64):
+
+    input_df = raw_df[coi].copy().drop_duplicates()
+    input_df["file_hash"] = hash_files(input_df[filepath_col].tolist())
+    hashes = input_df["file_hash"].dropna().unique().tolist()
+
+    # documents
+    documents = store.load_documents(encoding, hashes)
+    cached = input_df["file_hash"].isin(documents["file_hash"])
+    new = input_df[input_df["file_hash"].notna() & ~cached].drop_duplicates("file_hash")
+    results, counts = ingestion.ingest_files(new[filepath_col], encoding, num_workers, chunk_size, keep_tokens=flag_segment)
+    new_documents = pd.DataFrame({"file_hash": new["file_hash"].tolist(),
+                                  "status": [r["status"] for r in results],
+                                  "prompt": [r["prompt"] for r in results],
+                                  "prompt_tokens": [r["prompt_tokens"] for r in results]})
+    # files that vanished between hashing and reading are not recorded
+    new_documents = new_documents[new_documents["status"] != "missing"]
+    store.append_documents(new_documents, encoding)
+    documents = pd.concat([documents, new_documents], ignore_index=True).drop_duplicates("file_hash").set_index("file_hash")
+
+    counts["missing"] += int(input_df["file_hash"].isna().sum())
+    counts["cached"] = int(cached.sum())
+    cached_status = input_df.loc[cached, "file_hash"].map(documents["status"])
+    counts.update(cached_status[cached_status != "ok"].tolist())
+    documents = documents[documents["status"] == "ok"]
+
+    input_df = input_df[input_df["file_hash"].isin(documents.index)].copy()
+    input_df["prompt"] = input_df["file_hash"].map(documents["prompt"])
+    input_df["prompt_tokens"] = input_df["file_hash"].map(documents["prompt_tokens"]).astype("int64")
+
+    # segments
+    if flag_segment:
+        max_tokens = max_token_num - base_token_length
+        segments = store.load_segments(encoding, max_tokens, overlay, hashes)
+        to_segment = documents[~documents.index.isin(segments["file_hash"])].reset_index()
+        tokens = {h: r["tokens"] for h, r in zip(new["file_hash"], results) if r["tokens"] is not None}
+        docs = [tok.TokenizedDocument(p, tokens[h], encoding) if h in tokens else tok.TokenizedDocument.from_text(p, encoding)
+                for h, p in zip(to_segment["file_hash"], to_segment["prompt"])]
+        new_segments = util.segment_text_column(to_segment, "file_hash", max_token_num, overlay, base_token_length, encoding, docs)
+        store.append_segments(new_segments, encoding, max_tokens, overlay)
+        segments = pd.concat([segments, new_segments[SEGMENT_SCHEMA.names]], ignore_index=True)
+        segments = segments.drop_duplicates(["file_hash", "segment"]).sort_values(["file_hash", "segment"])
+
+        input_df = input_df.drop(columns=["prompt", "prompt_tokens"]).merge(segments, on="file_hash", how="inner")
+
+    input_df["total_tokens"] = input_df["prompt_tokens"] + base_token_length
+    columns = coi + ["prompt", "prompt_tokens", "total_tokens"] + (SEGMENT_COLUMNS if flag_segment else [])
+    input_df = input_df[list(dict.fromkeys(columns))]
+    input_df.attrs["ingest_counts"] = dict(counts)
+    return input_df
@@ -0,0 +1,174 @@
+import hashlib
+import re
+import zlib
+import numpy as np
+import pandas as pd
+from .prefilter import STANDARD_TERMS, KeywordIndex
+from .results import output_content, parse_json
+
+_word = re.compile(r"\w+")
+
+# Hash values are permuted as (a * x + b) mod _prime, a < 2**31 keeps the product within uint64
+_prime = np.uint64((1 << 32) + 15)
+_max_hash = np.uint64((1 << 32) - 1)
+
+
+# Hash of the whitespace normalized text, identical for exact duplicates
+def text_hash(text : str) -> str:
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).hexdigest()
+
+
+# crc32 of every word shingle (shingle_size consecutive lower cased words) of a text
+def shingles(text : str, shingle_size : int = 5) -> np.ndarray:
+    words = _word.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    grams = {" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def minhash_signatures(texts : list[str], num_perm : int = 128, shingle_size : int = 5, seed : int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+    signatures = np.full((len(texts), num_perm), _max_hash, dtype=np.uint64)
+    for i, text in enumerate(texts):
+        values = shingles(text, shingle_size)
+        if values.size:
+            signatures[i] = ((values[:, None] * a + b) % _prime).min(axis=0)
+    return signatures
+
+
+# Bands and rows per band whose LSH threshold (1 / bands) ** (1 / rows) is closest to threshold
+def lsh_params(threshold : float, num_perm : int = 128) -> tuple[int, int]:
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(options, key=lambda o: abs((1 / o[0]) ** (1 / o[1]) - threshold))
+
+
+class _UnionFind:
+    def __init__(self, n : int):
+        self.parent = list(range(n))
+
+    def find(self, i : int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i : int, j : int):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+# Representative of every segment, the first segment of its cluster in df order
+def cluster_segments(df : pd.DataFrame,
+                     threshold : float = 1.0,
+                     prompt_col : str = "prompt",
+                     num_perm : int = 128,
+                     shingle_size : int = 5,
+                     seed : int = 1) -> pd.Series:
+    """
+    # Clustering
+        - exact duplicates (after whitespace normalization) share a hash and form one cluster
+        - with threshold < 1 (see unverified_members before fanning out answers), the first segment of every exact cluster is MinHashed and LSH candidates whose
+          estimated Jaccard similarity of word shingles is at least threshold are merged (single linkage)
+    """
+    exact = df[prompt_col].map(text_hash)
+    first = ~exact.duplicated()
+    representative = pd.Series(df.index, index=df.index).groupby(exact.values).transform("first")
+
+    if threshold < 1 and first.sum() > 1:
+        unique = df.index[first.values]
+        signatures = minhash_signatures(df.loc[unique, prompt_col].tolist(), num_perm, shingle_size, seed)
+        bands, rows = lsh_params(threshold, num_perm)
+        clusters = _UnionFind(len(unique))
+        for band in range(bands):
+            block = signatures[:, band * rows:(band + 1) * rows]
+            buckets = {}
+            for i, key in enumerate(map(bytes, block)):
+                buckets.setdefault(key, []).append(i)
+            for members in buckets.values():
+                for j in members[1:]:
+                    if clusters.find(j) != clusters.find(members[0]) and \
+                            np.mean(signatures[members[0]] == signatures[j]) >= threshold:
+                        clusters.union(members[0], j)
+        near = pd.Series(unique[[clusters.find(i) for i in range(len(unique))]], index=unique)
+        representative = representative.map(near)
+
+    return representative
+
+
+# Representative segments to send to the model and the representative of every segment
+def dedup_segments(df : pd.DataFrame, threshold : float = 1.0, prompt_col : str = "prompt", **kwargs) -> tuple[pd.DataFrame, pd.Series]:
+    representative = cluster_segments(df, threshold, prompt_col, **kwargs)
+    return df.loc[representative.unique()], representative
+
+
+# Outputs of the representatives copied to every member of their cluster, with df (the segments) near duplicate
+# members that fail unverified_members get None instead
+def fan_out(representative : pd.Series, outputs : pd.Series, df : pd.DataFrame = None, prompt_col : str = "prompt") -> pd.Series:
+    fanned = pd.Series(outputs.reindex(representative.values).values, index=representative.index, dtype=object)
+    if df is not None:
+        fanned[unverified_members(df, representative, outputs, prompt_col)] = None
+    return fanned
+
+
+def _normalize(text : str) -> str:
+    return " ".join(str(text).lower().split())
+
+
+# Non-empty terms of an output
+def output_terms(output) -> list[str]:
+    parsed = parse_json(output_content(output))
+    if parsed is None:
+        return []
+    return [answer["term"] for answer in parsed.values()
+            if isinstance(answer, dict) and isinstance(answer.get("term"), str) and answer["term"].strip()]
+
+
+# Near duplicate members whose own text does not match the answer or the standard names of their representative
+def unverified_members(df : pd.DataFrame, representative : pd.Series, outputs : pd.Series, prompt_col : str = "prompt",
+                       index : KeywordIndex = None) -> pd.Index:
+    """
+    # Verification
+        - exact duplicates always share the output of their representative
+        - near duplicates can differ in exactly the sentence naming the standard (e.g. "IFRS as adopted by the EU"
+          against "UK GAAP including FRS 102") while their Jaccard similarity stays above the threshold, so a
+          member only keeps the fanned out output if
+            - every term of the output appears (case and whitespace insensitive) in the member's own prompt, and
+            - the member mentions the same standard names (index, default prefilter.STANDARD_TERMS) as its
+              representative, so a standard only the member names is not answered with the representative's
+              "no info"
+        - the returned members should be sent to the model themselves
+    """
+    index = index if index is not None else KeywordIndex(dict.fromkeys(STANDARD_TERMS, 1.0))
+    exact = df[prompt_col].map(text_hash)
+    near = df.index[(exact.values != exact.reindex(representative.values).values)]
+    mentions = {}
+    unverified = []
+    for row in near:
+        rep = representative[row]
+        if rep not in mentions:
+            mentions[rep] = index.matches(df.at[rep, prompt_col])
+        terms = output_terms(outputs.get(rep))
+        prompt = _normalize(df.at[row, prompt_col])
+        if any(_normalize(term) not in prompt for term in terms) or index.matches(df.at[row, prompt_col]) != mentions[rep]:
+            unverified.append(row)
+    return pd.Index(unverified, dtype=df.index.dtype)
+
+
+def dedup_stats(df : pd.DataFrame, representative : pd.Series, prompt_col : str = "prompt", tokens_col : str = "total_tokens") -> dict:
+    sizes = representative.value_counts()
+    exact = df[prompt_col].map(text_hash)
+    exact_duplicates = int(exact.duplicated().sum())
+    stats = {"segments": len(df),
+             "clusters": len(sizes),
+             "exact_duplicates": exact_duplicates,
+             "near_duplicates": len(df) - len(sizes) - exact_duplicates,
+             "largest_cluster": int(sizes.max()) if len(sizes) else 0,
+             "cluster_sizes": sizes.value_counts().sort_index().to_dict()}
+    if tokens_col in df.columns:
+        stats["tokens"] = int(df[tokens_col].sum())
+        stats["tokens_saved"] = stats["tokens"] - int(df.loc[sizes.index, tokens_col].sum())
+    return stats
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import pandas as pd
+from . import telemetry
+from . import tokenization as tok
+
+# Rendered contexts of this process by key, persisted as <key>.json in cache_dir when given
+_contexts = {}
+
+
+# (user, assistant) pair of every example in a single pass over df
+def example_pairs(df : pd.DataFrame, id_col : str, source_col : str, paragraph_col : str, sentence_col : str,
+                  standard_col : str, incl_sentence : bool, flag_segmented : bool) -> list[tuple[str,str]]:
+    """
+    # Examples
+        - segmented: one example per row, the paragraph and the answer of its source
+        - not segmented: one example per id (in order of first appearance), the first paragraph of every source
+          joined by " ... " and the answers of all sources
+    """
+    pairs = []
+    if flag_segmented:
+        columns = [paragraph_col, source_col, sentence_col, standard_col]
+        for paragraph, source, sentence, standard in df[columns].itertuples(index=False, name=None):
+            answer = {"sentence": sentence, "term": standard} if incl_sentence else {"term": standard}
+            pairs.append((paragraph, json.dumps({source: answer})))
+        return pairs
+
+    firsts = df.drop_duplicates([id_col, source_col])
+    for _, group in firsts.groupby(id_col, sort=False):
+        user_content = ""
+        assistant_content = {}
+        for paragraph, source, sentence, standard in group[[paragraph_col, source_col, sentence_col, standard_col]].itertuples(index=False, name=None):
+            user_content += str(paragraph) + " ... "
+            if incl_sentence:
+                assistant_content[source] = {"sentence": str(sentence), "term": str(standard)}
+            else:
+                assistant_content[source] = {"term": str(standard)}
+        pairs.append((user_content, json.dumps(assistant_content)))
+    return pairs
+
+
+def render_example(i : int, user : str, assistant : str) -> str:
+    return "\nExample " + str(i) + ":\n" + str(user) + "\nAnswer " + str(i) + ":\n" + assistant + "\n"
+
+
+def render_examples(pairs : list[tuple[str,str]], base : str = "") -> str:
+    return base + "".join(render_example(i, user, assistant) for i, (user, assistant) in enumerate(pairs))
+
+
+def context_tokens(system : str, user_assistant : list[tuple[str,str]] = None, encoding : str = "cl100k_base") -> int:
+    encoder = tok.get_encoder(encoding)
+    num_tokens = len(encoder.encode(system))
+    for user, assistant in user_assistant or []:
+        num_tokens += len(encoder.encode(user)) + len(encoder.encode(assistant))
+    return num_tokens
+
+
+# Positions of the examples kept, in order, while the context stays within budget tokens
+def select_examples(system : str, pairs : list[tuple[str,str]], budget : int, flag_UA : bool, base_prompt : str = "",
+                    encoding : str = "cl100k_base") -> list[int]:
+    """
+    # Selection
+        - examples are taken in order of pairs, an example that does not fit is skipped and later (shorter) ones
+          are still tried, so put the preferred examples first
+        - examples rendered into the system prompt are priced with their final numbering, token merges across
+          example boundaries are settled by dropping the last examples until the rendered context fits
+    """
+    encoder = tok.get_encoder(encoding)
+    used = len(encoder.encode(system + (base_prompt if not flag_UA else "")))
+    selected = []
+    for i, (user, assistant) in enumerate(pairs):
+        if flag_UA:
+            cost = len(encoder.encode(user)) + len(encoder.encode(assistant))
+        else:
+            cost = len(encoder.encode(render_example(len(selected), user, assistant)))
+        if used + cost <= budget:
+            selected.append(i)
+            used += cost
+
+    if not flag_UA:
+        while selected and len(encoder.encode(system + render_examples([pairs[i] for i in selected], base_prompt))) > budget:
+            selected.pop()
+    return selected
+
+
+def context_key(df : pd.DataFrame, columns : list[str], system : str, **settings) -> str:
+    examples = json.dumps(df[columns].values.tolist(), default=str, ensure_ascii=False)
+    request = json.dumps({"system": system, "columns": columns, "examples": examples, **settings},
+                         sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+# System prompt with the examples, user/assistant examples and their number of tokens, cached by example set
+def fewshot_context(system : str,
+                    df : pd.DataFrame,
+                    id_col : str,
+                    source_col : str,
+                    paragraph_col : str,
+                    sentence_col : str,
+                    standard_col : str,
+                    incl_sentence : bool,
+                    flag_UA : bool,
+                    flag_segmented : bool,
+                    base_prompt : str = "",
+                    encoding : str = "cl100k_base",
+                    budget : int = None,
+                    cache_dir : str = None) -> tuple[str, list[tuple[str,str]], int]:
+    """
+    # Context
+        - flag_UA: examples are returned as user/assistant pairs (None otherwise) and the system prompt is unchanged,
+          else they are appended to the system prompt after base_prompt, as in utility.prep_fs_examples
+        - budget: maximum number of context tokens, see select_examples, None keeps all examples
+    # Cache
+        - keyed by the sha256 of system, the example columns of df and the settings, so changing any example or
+          setting renders a new context
+        - kept in memory and, with cache_dir, as json files that are reused by later sessions
+    """
+    columns = [id_col, source_col, paragraph_col, sentence_col, standard_col]
+    key = context_key(df, columns, system, incl_sentence=incl_sentence, flag_UA=flag_UA, flag_segmented=flag_segmented,
+                      base_prompt=base_prompt, encoding=encoding, budget=budget)
+    path = os.path.join(cache_dir, key + ".json") if cache_dir else None
+
+    context = _contexts.get(key)
+    if context is None and path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            context = json.load(file)
+    if context is None:
+        with telemetry.stage("fewshot", items=len(df)):
+            pairs = example_pairs(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence, flag_segmented)
+            if budget is not None:
+                pairs = [pairs[i] for i in select_examples(system, pairs, budget, flag_UA, base_prompt, encoding)]
+            user_assistant = pairs if flag_UA else None
+            rendered = system if flag_UA else system + render_examples(pairs, base_prompt)
+            context = {"system": rendered,
+                       "user_assistant": user_assistant,
+                       "base_token_length": context_tokens(rendered, user_assistant, encoding),
+                       "num_examples": len(pairs)}
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(context, file, ensure_ascii=False)
+    _contexts[key] = context
+
+    user_assistant = [tuple(pair) for pair in context["user_assistant"]] if context["user_assistant"] is not None else None
+    return context["system"], user_assistant, context["base_token_length"]
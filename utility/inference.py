@@ -0,0 +1,169 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from openai import OpenAI
+from tqdm.auto import tqdm
+from . import telemetry
+from . import utility as util
+from .batch import batch_custom_ids
+from .journal import run_fingerprint
+
+
+# Token bucket refilled continuously at a per minute rate
+class TokenBucket:
+    def __init__(self, per_minute : float, capacity : float = None):
+        self.rate = per_minute / 60
+        self.capacity = capacity if capacity else per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now : float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount : float) -> float:
+        # requests larger than the bucket are let through once it is full
+        amount = min(amount, self.capacity)
+        return max(0, (amount - self.level) / self.rate)
+
+    def consume(self, amount : float):
+        self.level -= min(amount, self.capacity)
+
+
+# Enforces requests per minute and tokens per minute limits across threads
+class RateLimiter:
+    def __init__(self, rpm : float, tpm : float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.lock = threading.Lock()
+
+    def acquire(self, num_tokens : int):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(num_tokens))
+                if wait == 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(num_tokens)
+                    return
+            time.sleep(wait)
+
+
+# Single request, answered from the cache if possible, otherwise sent once the rate limiter lets it through
+def request_completion(client : OpenAI,
+                       system : str,
+                       prompt : str,
+                       user_assistant : list[tuple[str,str]],
+                       model : str,
+                       temp,
+                       num_tokens : int,
+                       limiter : RateLimiter,
+                       cache = None,
+                       compact : bool = False):
+    messages = util.create_messages_context_gpt(system, prompt, user_assistant)
+    output = None
+    start = time.perf_counter()
+    if cache is not None:
+        key = cache.make_key(model, messages, temp)
+        output = cache.get(key)
+    if output is None:
+        limiter.acquire(num_tokens)
+        start = time.perf_counter()
+        output = util.get_completion(client, messages, model, temp)
+        if cache is not None:
+            cache.put(key, model, output)
+    if compact:
+        return util.compact_completion(output, time.perf_counter() - start)
+    return output
+
+
+# Run prompts concurrently, results are returned in input order
+def run_prompts(client : OpenAI,
+                system : str,
+                prompts : list[str],
+                user_assistant : list[tuple[str,str]] = None,
+                model : str = "gpt-3.5-turbo-0125",
+                temp = 0,
+                tokens : list[int] = None,
+                max_workers : int = 16,
+                rpm : int = 10_000,
+                tpm : int = 1_000_000,
+                progress : bool = True,
+                cache = None,
+                journal = None,
+                keys : list[str] = None,
+                compact : bool = False):
+    """
+    # Scheduling
+        - up to max_workers requests are in flight at any time
+        - before a request is sent it waits for one request and its number of tokens from the rate limiter
+        - tokens should be the total number of tokens of each request (e.g. df_inputs['total_tokens']),
+          if not provided they are counted from the prompts
+        - with a cache (see cache.ResponseCache) cached requests are answered without waiting for the rate limiter
+        - with compact, outputs are util.compact_completion records instead of full response objects
+    # Journal
+        - with a journal (see journal.RunJournal) and one key per prompt, completed requests are recorded as they
+          arrive and keys already completed are not sent again, so an interrupted run resumes where it stopped,
+          entries recorded with another model, temperature, system prompt or examples are not reused
+        - requests that still fail after get_completion's retries are recorded as failed and returned as None
+          instead of ending the run
+        - without a journal the first failure ends the run, queued requests are cancelled and only the ones in
+          flight finish
+    """
+    prompts = list(prompts)
+    if tokens is None:
+        tokens = [util.count_tokens(p) for p in prompts]
+    tokens = list(tokens)
+
+    limiter = RateLimiter(rpm, tpm)
+    results = [None] * len(prompts)
+    if journal is not None:
+        journal.set_run(run_fingerprint(model, temp, system, user_assistant))
+
+    def task(i):
+        if journal is not None and journal.is_done(keys[i]):
+            return journal.output(keys[i])
+        return request_completion(client, system, prompts[i], user_assistant, model, temp, tokens[i], limiter, cache, compact)
+
+    with telemetry.stage("inference"), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(task, i): i for i in range(len(prompts))}
+        for future in tqdm(as_completed(futures), total=len(futures), disable=not progress):
+            i = futures[future]
+            try:
+                output = future.result()
+            except Exception as error:
+                if journal is None:
+                    # queued requests would otherwise all be sent (and retried) before the error surfaces
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+                journal.record_failure(keys[i], error)
+                continue
+            if journal is not None and not journal.is_done(keys[i]):
+                journal.record(keys[i], output)
+            results[i] = output
+
+    if journal is not None:
+        journal.flush()
+
+    return results
+
+
+def prompt_gpt_df(client : OpenAI,
+                  system : str,
+                  df : pd.DataFrame,
+                  user_assistant : list[tuple[str,str]] = None,
+                  model : str = "gpt-3.5-turbo-0125",
+                  temp = 0,
+                  prompt_col : str = "prompt",
+                  tokens_col : str = "total_tokens",
+                  id_col : str = "filename",
+                  segment_col : str = "segment",
+                  **kwargs) -> pd.Series:
+    tokens = df[tokens_col].tolist() if tokens_col in df.columns else None
+    if kwargs.get("journal") is not None and kwargs.get("keys") is None:
+        kwargs["keys"] = batch_custom_ids(df, id_col, segment_col).tolist()
+    outputs = run_prompts(client, system, df[prompt_col].tolist(), user_assistant, model, temp, tokens, **kwargs)
+    return pd.Series(outputs, index=df.index, dtype=object)
@@ -0,0 +1,114 @@
+import os
+import re
+from collections import Counter, deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import telemetry
+from . import text_cleaning as tc
+from . import tokenization as tok
+
+_word = re.compile(r'\w+')
+
+
+# Read text file and report why it could not be used: "ok", "missing", "undecodable" or "empty"
+def read_txt(file_path : str) -> tuple[str, str]:
+    if not os.path.isfile(file_path):
+        return None, "missing"
+    try:
+        with open(file_path, "r") as file:
+            text = file.read()
+    except UnicodeDecodeError:
+        return None, "undecodable"
+    # checks whether text contains words temporary solution
+    # data should be cleaned before creating datasets
+    if not _word.search(text):
+        return None, "empty"
+    return text, "ok"
+
+
+# Read, clean and tokenize a single file
+def ingest_file(file_path : str, encoding : str = "cl100k_base", keep_tokens : bool = False) -> dict:
+    with telemetry.stage("ingest.read"):
+        text, status = read_txt(file_path)
+    if text is None:
+        return {"status": status, "prompt": None, "prompt_tokens": 0, "tokens": None}
+    with telemetry.stage("ingest.clean", len(text)):
+        prompt = tc.clean_text(text)
+    with telemetry.stage("ingest.tokenize", len(prompt)):
+        tokens = tok.get_encoder(encoding).encode(prompt)
+    return {"status": status,
+            "prompt": prompt,
+            "prompt_tokens": len(tokens),
+            "tokens": np.asarray(tokens, dtype=np.uint32) if keep_tokens else None}
+
+
+def _ingest_chunk(file_paths : list[str], encoding : str, keep_tokens : bool) -> list[dict]:
+    return [ingest_file(path, encoding, keep_tokens) for path in file_paths]
+
+
+# Chunk run in a worker process, with timings the worker records its own stages and returns them for merging
+def _ingest_chunk_worker(file_paths : list[str], encoding : str, keep_tokens : bool, timings : bool) -> tuple[list[dict], dict]:
+    if not timings:
+        return _ingest_chunk(file_paths, encoding, keep_tokens), None
+    recorder = telemetry.enable()
+    try:
+        return _ingest_chunk(file_paths, encoding, keep_tokens), recorder.stages
+    finally:
+        telemetry.disable()
+
+
+def _chunked(items, chunk_size : int):
+    items = iter(items)
+    while chunk := list(islice(items, chunk_size)):
+        yield chunk
+
+
+# Ingest files in chunks across processes, yields one list of results per chunk in input order
+def iter_ingest(file_paths : list[str],
+                encoding : str = "cl100k_base",
+                num_workers : int = None,
+                chunk_size : int = 64,
+                keep_tokens : bool = False):
+    """
+    # Memory
+        - at most 2 * num_workers chunks are submitted or waiting to be consumed at any time,
+          so memory is bounded by chunk_size rather than by the number of files
+        - file_paths can be any iterable, it is consumed lazily so paths can be streamed
+        - num_workers = 1 or a single chunk runs in the calling process
+        - with telemetry enabled, the stages recorded in worker processes are merged into it
+    """
+    chunks = _chunked(file_paths, chunk_size)
+    num_workers = num_workers or os.cpu_count() or 1
+
+    first = list(islice(chunks, 2))
+    chunks = chain(first, chunks)
+    if num_workers == 1 or len(first) <= 1:
+        for chunk in chunks:
+            yield _ingest_chunk(chunk, encoding, keep_tokens)
+        return
+
+    timings = telemetry.enabled()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_ingest_chunk_worker, chunk, encoding, keep_tokens, timings))
+            if len(pending) >= 2 * num_workers:
+                break
+        while pending:
+            results, stages = pending.popleft().result()
+            telemetry.merge_stages(stages)
+            for chunk in chunks:
+                pending.append(executor.submit(_ingest_chunk_worker, chunk, encoding, keep_tokens, timings))
+                break
+            yield results
+
+
+# Ingest all files, returns results in input order and counts per status
+def ingest_files(file_paths : list[str], encoding : str = "cl100k_base", num_workers : int = None,
+                 chunk_size : int = 64, keep_tokens : bool = False) -> tuple[list[dict], Counter]:
+    results = []
+    for chunk in iter_ingest(file_paths, encoding, num_workers, chunk_size, keep_tokens):
+        results.extend(chunk)
+    counts = Counter(r["status"] for r in results)
+    return results, counts
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+import pandas as pd
+from openai.types.chat import ChatCompletion
+from tenacity import RetryError
+from . import utility as util
+from .batch import batch_custom_ids
+from .cache import ResponseCache
+
+
+# Hash of everything besides the prompt that determines an output: model, temperature, system prompt and examples
+def run_fingerprint(model : str, temp, system : str, user_assistant : list[tuple[str,str]] = None) -> str:
+    return ResponseCache.make_key(model, util.create_messages_context_gpt(system, "", user_assistant), temp)
+
+
+# Append-only JSONL journal of completed and failed requests of a run
+class RunJournal:
+    """
+    # Entries
+        {"key": "<filename>::<segment>", "run": ..., "status": "ok" | "failed", "output": ..., "error": ..., "time": ...}
+        - run is the run_fingerprint of the requests, only entries of the current run (see set_run) are loaded, so
+          changing the model, temperature, system prompt or examples sends every request again
+        - the last entry of a key wins, so a successful retry overrides an earlier failure
+        - entries are buffered and written + fsynced every flush_every entries or flush_interval seconds
+        - a partially written last line (e.g. after the kernel died) is ignored when loading
+    """
+
+    def __init__(self, path : str, run : str = None, flush_every : int = 32, flush_interval : float = 1.0, fsync : bool = True):
+        self.path = path
+        self.run = run
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.completed = {}
+        self.failed = {}
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self._load()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("run") == self.run:
+                    self._apply(entry)
+
+    # Entries of another run are set aside, inference.run_prompts sets the run of its requests before sending them
+    def set_run(self, run : str):
+        with self.lock:
+            if run == self.run:
+                return
+            self._flush()
+            self.run = run
+            self.completed = {}
+            self.failed = {}
+            self._load()
+
+    def _apply(self, entry : dict):
+        if entry["status"] == "ok":
+            self.completed[entry["key"]] = entry["output"]
+            self.failed.pop(entry["key"], None)
+        else:
+            self.failed[entry["key"]] = entry["error"]
+
+    def _append(self, entry : dict):
+        with self.lock:
+            self._apply(entry)
+            self.buffer.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            if len(self.buffer) >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def record(self, key : str, output):
+        if isinstance(output, ChatCompletion):
+            output = output.model_dump(mode="json")
+        self._append({"key": key, "run": self.run, "status": "ok", "output": output, "time": time.time()})
+
+    def record_failure(self, key : str, error):
+        # get_completion gave up, record the error of its last attempt
+        if isinstance(error, RetryError) and error.last_attempt.failed:
+            error = error.last_attempt.exception()
+        self._append({"key": key, "run": self.run, "status": "failed", "error": repr(error), "time": time.time()})
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def is_done(self, key : str) -> bool:
+        return key in self.completed
+
+    def output(self, key : str):
+        output = self.completed.get(key)
+        if isinstance(output, dict) and output.get("object") == "chat.completion":
+            return ChatCompletion.model_validate(output)
+        return output
+
+    # Rows of df that still have to be run, or that failed permanently
+    def pending_rows(self, df : pd.DataFrame, id_col : str = "filename", segment_col : str = "segment") -> pd.DataFrame:
+        return df[~batch_custom_ids(df, id_col, segment_col).isin(self.completed.keys())]
+
+    def failed_rows(self, df : pd.DataFrame, id_col : str = "filename", segment_col : str = "segment") -> pd.DataFrame:
+        return df[batch_custom_ids(df, id_col, segment_col).isin(self.failed.keys())]
+
+    def outputs(self, df : pd.DataFrame, id_col : str = "filename", segment_col : str = "segment") -> pd.Series:
+        return batch_custom_ids(df, id_col, segment_col).map(self.output).astype(object)
@@ -0,0 +1,146 @@
+import json
+from bisect import bisect_left, insort
+import pandas as pd
+from . import fewshot
+from . import prompts
+from . import results
+from . import utility as util
+from .batch import make_custom_id
+
+SEGMENT_TEMPLATE = '<segment id="{id}">\n{text}\n</segment>\n'
+
+# Tags and text are counted separately, tokens merged or split differently where they meet (before and after the
+# text) can change the count of the wrapped segment by about one token per boundary
+BOUNDARY_TOKENS = 2
+
+
+# Tokens added by the segment tags around a text
+def wrapper_tokens(segment_id : str, encoding : str = "cl100k_base") -> int:
+    return util.count_tokens(SEGMENT_TEMPLATE.format(id=segment_id, text=""), encoding) + BOUNDARY_TOKENS
+
+
+# System prompt for packed requests, the examples wrapped in segment tags with answers keyed by segment id
+def packed_context(system : str,
+                   df : pd.DataFrame,
+                   id_col : str,
+                   source_col : str,
+                   paragraph_col : str,
+                   sentence_col : str,
+                   standard_col : str,
+                   incl_sentence : bool,
+                   flag_UA : bool = False,
+                   flag_segmented : bool = True,
+                   base_prompt : str = "",
+                   encoding : str = "cl100k_base") -> tuple[str, list[tuple[str,str]], int]:
+    """
+    # Context
+        - system is the system prompt without examples (e.g. system_segmented of the notebook), it is extended by
+          prompts.task_descr_packed and prompts.answer_format_packed
+        - examples are rendered as in fewshot.fewshot_context, but in the packed answer format
+        - returns the system prompt, the user/assistant examples (None unless flag_UA) and their number of tokens,
+          the base_token_length for plan_packs, build_packs and calc_packing_savings
+    """
+    examples = []
+    for i, (user, assistant) in enumerate(fewshot.example_pairs(df, id_col, source_col, paragraph_col, sentence_col,
+                                                                standard_col, incl_sentence, flag_segmented)):
+        segment_id = f"example_{i}"
+        examples.append((SEGMENT_TEMPLATE.format(id=segment_id, text=user), json.dumps({segment_id: json.loads(assistant)})))
+
+    system = system + prompts.task_descr_packed + prompts.answer_format_packed
+    user_assistant = examples if flag_UA else None
+    if not flag_UA:
+        system += fewshot.render_examples(examples, base_prompt)
+    return system, user_assistant, fewshot.context_tokens(system, user_assistant, encoding)
+
+
+# Assign rows to packs with best fit decreasing, each pack fits max_token_num including the base context
+def plan_packs(df : pd.DataFrame,
+               max_token_num : int,
+               base_token_length : int,
+               id_col : str = "filename",
+               segment_col : str = "segment",
+               max_segments : int = 8,
+               encoding : str = "cl100k_base") -> pd.DataFrame:
+    """
+    # Packing plan
+        - returns a copy of df with a segment_id (as in batch.make_custom_id) and the pack each row is assigned to
+        - rows too large to share a request get a pack of their own
+        - max_segments limits the number of segments per pack, and with it the length of the answer
+        - base_token_length is the length of the packed context, see packed_context
+    """
+    df = df.copy()
+    segments = df[segment_col] if segment_col in df.columns else [None] * len(df)
+    df["segment_id"] = [make_custom_id(f, s) for f, s in zip(df[id_col], segments)]
+    sizes = df["prompt_tokens"].to_numpy() + [wrapper_tokens(i, encoding) for i in df["segment_id"]]
+    capacity = max_token_num - base_token_length
+
+    packs = [0] * len(df)
+    counts = []
+    # open packs as sorted (remaining tokens, pack) tuples
+    remaining = []
+    for position in sorted(range(len(df)), key=lambda p: -sizes[p]):
+        size = int(sizes[position])
+        i = bisect_left(remaining, (size, -1))
+        if i < len(remaining):
+            space, pack = remaining.pop(i)
+        else:
+            space, pack = capacity, len(counts)
+            counts.append(0)
+        packs[position] = pack
+        counts[pack] += 1
+        if counts[pack] < max_segments and space - size > 0:
+            insort(remaining, (space - size, pack))
+
+    df["pack"] = packs
+    return df
+
+
+# One request per pack, members in their original order
+def build_packs(plan : pd.DataFrame, base_token_length : int, prompt_col : str = "prompt", encoding : str = "cl100k_base") -> pd.DataFrame:
+    records = []
+    for pack, members in plan.groupby("pack", sort=True):
+        prompt = "".join(SEGMENT_TEMPLATE.format(id=i, text=t) for i, t in zip(members["segment_id"], members[prompt_col]))
+        records.append({"pack": pack,
+                        "segment_ids": members["segment_id"].tolist(),
+                        "num_segments": len(members),
+                        "prompt": prompt,
+                        "prompt_tokens": util.count_tokens(prompt, encoding)})
+    packs = pd.DataFrame.from_records(records, columns=["pack", "segment_ids", "num_segments", "prompt", "prompt_tokens"])
+    packs["total_tokens"] = packs["prompt_tokens"] + base_token_length
+    return packs
+
+
+def pack_segments(df : pd.DataFrame, max_token_num : int, base_token_length : int, encoding : str = "cl100k_base",
+                  **kwargs) -> tuple[pd.DataFrame, pd.DataFrame]:
+    plan = plan_packs(df, max_token_num, base_token_length, encoding=encoding, **kwargs)
+    return plan, build_packs(plan, base_token_length, encoding=encoding)
+
+
+# Split the answers to packed requests (responses, compact records or strings) back into one answer (json string)
+# per row of the plan
+def unpack_outputs(plan : pd.DataFrame, packs : pd.DataFrame, outputs : pd.Series) -> pd.Series:
+    answers = {}
+    for segment_ids, output in zip(packs["segment_ids"], outputs):
+        parsed = results.parse_json(results.output_content(output))
+        if parsed is None:
+            continue
+        for segment_id in segment_ids:
+            if segment_id in parsed:
+                answers[segment_id] = json.dumps(parsed[segment_id])
+    return plan["segment_id"].map(answers)
+
+
+# Price and compute time estimates for sending df as is and as packed
+def calc_packing_savings(df : pd.DataFrame, packs : pd.DataFrame, price, tokens_per_minute, tokens_per_price = 1000) -> pd.DataFrame:
+    rows = {}
+    for name, requests in [("unpacked", df), ("packed", packs)]:
+        num_requests = len(requests)
+        avg_tok_size = requests["total_tokens"].mean() if num_requests else 0
+        rows[name] = {"requests": num_requests,
+                      "tokens": int(requests["total_tokens"].sum()),
+                      "$ (excl. VAT)": util.calc_price_gpt(num_requests, avg_tok_size, 1, price, tokens_per_price)["$ (excl. VAT)"],
+                      "raw min": util.calc_compute_time(num_requests, avg_tok_size, 1, tokens_per_minute)["raw min"]}
+    report = pd.DataFrame(rows).T
+    report.loc["savings"] = report.loc["unpacked"] - report.loc["packed"]
+    report.loc["savings %"] = report.loc["savings"] / report.loc["unpacked"] * 100
+    return report
@@ -0,0 +1,376 @@
+import argparse
+import copy
+import json
+import os
+import queue
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import yaml
+from dotenv import load_dotenv, find_dotenv
+from openai import OpenAI
+from . import utility as util
+from . import prompts
+from . import fewshot
+from . import ingestion
+from . import inference
+from . import prefilter
+from . import results
+from . import telemetry
+from .batch import batch_custom_ids
+from .cache import ResponseCache
+from .journal import RunJournal, run_fingerprint
+
+# Settings of Extract_Stds_GPT.ipynb, a config file only needs the keys it changes
+DEFAULT_CONFIG = {
+    "model": "gpt-3.5-turbo-0125",
+    "temperature": 0,
+    "encoding": "cl100k_base",
+    "min_ratio": 0.5,
+    # few shot settings
+    "incl_sentence": True,
+    "flag_UA": False,
+    "flag_segmented": True,
+    # maximum tokens of the system prompt and examples, None keeps all examples
+    "fewshot_budget": None,
+    # segmentation settings
+    "max_token_num": 15900,
+    "overlay": 200,
+    # keyword prefilter
+    "flag_prefilter": True,
+    "prefilter_threshold": 3.0,
+    # rate limits and concurrency
+    "rpm": 10_000,
+    "tpm": 1_000_000,
+    "max_workers": 16,
+    # ingestion processes (default: all cores) and files per chunk
+    "num_workers": None,
+    "chunk_size": 64,
+    # chunks prepared ahead of inference and chunks with requests in flight
+    "queue_size": 4,
+    "max_pending_chunks": 2,
+    # answer of a document per source, see results.resolve_answers
+    "policy": "first",
+    # "examples": test rows of the examples sheet, "statements": every .txt file in paths.statements
+    "inputs": "examples",
+    "columns": ["filepath", "filename", "cc_iso3"],
+    "examples": {"sheet": "Sheet1",
+                 "prompt_indices": [0, 1, 2, 3, 4, 5, 6, 7, 16, 17, 20, 21, 26, 27, 34, 35, 36, 37],
+                 "drop_columns": ["checked by", "new", "manual", "page (txt)", "note"]},
+    # unset paths disable the few shot and response caches, journal and telemetry
+    "paths": {"statements": os.path.join("data", "predict"),
+              "examples": os.path.join("data", "examples_altered.xlsx"),
+              "fewshot": os.path.join("data", "fewshot_cache"),
+              "cache": os.path.join("data", "responses_cache.sqlite"),
+              "journal": os.path.join("data", "run_journal.jsonl"),
+              "telemetry": os.path.join("data", "telemetry.json"),
+              "outputs": os.path.join("data", "outputs.jsonl"),
+              "answers": os.path.join("data", "answers.csv"),
+              "labels": os.path.join("data", "labels.csv")},
+}
+
+
+def _merge(defaults : dict, overrides : dict) -> dict:
+    merged = copy.deepcopy(defaults)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(path : str = None) -> dict:
+    if path is None:
+        return copy.deepcopy(DEFAULT_CONFIG)
+    with open(path, "r", encoding="utf-8") as file:
+        return _merge(DEFAULT_CONFIG, yaml.safe_load(file))
+
+
+# Examples sheet split into few shot examples and inference samples, as in the notebook
+def load_examples(config : dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+    df_meta = pd.read_excel(config["paths"]["examples"], sheet_name=config["examples"]["sheet"])
+    df_meta.dropna(axis=1, inplace=True, thresh=int(df_meta.shape[0]*.1))
+    df_meta.drop(columns=config["examples"]["drop_columns"], inplace=True, errors="ignore")
+    df_meta["filename"] = df_meta["filename"].astype("str") + ".txt"
+    df_meta["filepath"] = df_meta["filename"].apply(lambda x: os.path.join(config["paths"]["statements"], x))
+
+    prompt_indices = config["examples"]["prompt_indices"]
+    test_indices = [i for i in df_meta.index if i not in prompt_indices]
+    return df_meta.iloc[prompt_indices,:].copy(), df_meta.iloc[test_indices,:].copy()
+
+
+# System context, user/assistant examples and their number of tokens
+def build_context(prompt_df : pd.DataFrame, config : dict) -> tuple[str, list[tuple[str,str]], int]:
+    terms_auditor = util.concat_terms(util.det_commonly_used_terms(prompt_df["terms_audit"], min_ratio=config["min_ratio"]), ", ")
+    terms_notes = util.concat_terms(util.det_commonly_used_terms(prompt_df["terms_notes"], min_ratio=config["min_ratio"]), ", ")
+    section_terms_auditor = prompts.common_terms_section_auditor.format(terms_auditor=terms_auditor)
+    section_terms_notes = prompts.common_terms_section_notes.format(terms_notes=terms_notes)
+
+    if config["flag_segmented"]:
+        system = prompts.system_context_basic + prompts.task_descr_2 + section_terms_auditor + section_terms_notes + \
+                 prompts.instruction_2 + prompts.answer_format2
+    else:
+        system = prompts.system_context_basic + prompts.task_descr_1 + section_terms_auditor + section_terms_notes + \
+                 prompts.instruction_1 + prompts.answer_format1
+
+    return fewshot.fewshot_context(system,
+                                   prompt_df,
+                                   id_col="filename",
+                                   source_col="source",
+                                   paragraph_col="paragraph (context)",
+                                   sentence_col="sentence",
+                                   standard_col="term",
+                                   incl_sentence=config["incl_sentence"],
+                                   flag_UA=config["flag_UA"],
+                                   flag_segmented=config["flag_segmented"],
+                                   base_prompt=prompts.examples_base1,
+                                   encoding=config["encoding"],
+                                   budget=config["fewshot_budget"],
+                                   cache_dir=config["paths"]["fewshot"])
+
+
+# Input rows (at least filepath and filename), streamed from the statements directory or the test examples
+def iter_rows(config : dict, test_df : pd.DataFrame = None):
+    seen = set()
+    if config["inputs"] == "statements":
+        rows = ({"filepath": entry.path, "filename": entry.name}
+                for entry in os.scandir(config["paths"]["statements"]) if entry.name.endswith(".txt"))
+    elif config["inputs"] == "examples":
+        columns = [c for c in config["columns"] if c in test_df.columns]
+        rows = test_df[columns].to_dict("records")
+    else:
+        raise ValueError(f"Unknown inputs: {config['inputs']}")
+    for row in rows:
+        if row["filepath"] not in seen:
+            seen.add(row["filepath"])
+            yield row
+
+
+# One input table per ingested chunk of files, as prep_inputs would return for the rows of the chunk
+def iter_inputs(rows, config : dict, base_token_length : int, counts : Counter):
+    consumed = deque()
+
+    def paths():
+        for row in rows:
+            consumed.append(row)
+            yield row["filepath"]
+
+    chunks = ingestion.iter_ingest(paths(), config["encoding"], config["num_workers"], config["chunk_size"],
+                                   keep_tokens=config["flag_segmented"])
+    for chunk in chunks:
+        counts.update(r["status"] for r in chunk)
+        input_df = pd.DataFrame([consumed.popleft() for _ in chunk])
+        with telemetry.stage("pipeline.segment"):
+            input_df = util.inputs_from_results(input_df, chunk, "filename", base_token_length, config["flag_segmented"],
+                                                config["max_token_num"], config["overlay"], config["encoding"])
+        if not input_df.empty:
+            yield input_df
+
+
+def iter_prefiltered(chunks, index : prefilter.KeywordIndex, threshold : float, counts : Counter):
+    for chunk in chunks:
+        filtered, stats = prefilter.prefilter_segments(chunk, index, threshold)
+        counts["segments"] += stats["segments"]
+        counts["segments_kept"] += stats["segments_kept"]
+        if not filtered.empty:
+            yield filtered
+
+
+# Items of iterable produced by a background thread, at most maxsize items ahead of the consumer
+def background(iterable, maxsize : int):
+    items = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            items.put(done)
+        except BaseException as error:
+            items.put(error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (item := items.get()) is not done:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+# Chunks with an output column, requests of up to max_pending_chunks chunks are in flight at the same time
+def iter_completions(chunks, client : OpenAI, system : str, user_assistant : list[tuple[str,str]], config : dict,
+                     cache : ResponseCache = None, journal : RunJournal = None, counts : Counter = None):
+    """
+    # Scheduling
+        - requests share one rate limiter and worker pool across chunks, so a new chunk's requests start while
+          the last requests of earlier chunks are still in flight
+        - chunks are yielded in input order once all their requests have finished
+        - as in inference.run_prompts, keys completed in the journal are not sent again and requests that still
+          fail after get_completion's retries are recorded as failed and get no output, without a journal the
+          first failure cancels the queued requests and ends the run
+    """
+    counts = counts if counts is not None else Counter()
+    limiter = inference.RateLimiter(config["rpm"], config["tpm"])
+    if journal is not None:
+        journal.set_run(run_fingerprint(config["model"], config["temperature"], system, user_assistant))
+
+    def task(prompt, num_tokens, key):
+        if journal is not None and journal.is_done(key):
+            return journal.output(key)
+        return inference.request_completion(client, system, prompt, user_assistant, config["model"], config["temperature"],
+                                            num_tokens, limiter, cache, compact=True)
+
+    def finish(chunk, keys, futures):
+        outputs = []
+        for key, future in zip(keys, futures):
+            try:
+                output = future.result()
+            except Exception as error:
+                if journal is None:
+                    raise
+                journal.record_failure(key, error)
+                counts["failed"] += 1
+                outputs.append(None)
+                continue
+            if journal is not None and not journal.is_done(key):
+                journal.record(key, output)
+            counts["requests"] += 1
+            outputs.append(output)
+        if journal is not None:
+            journal.flush()
+        chunk = chunk.copy()
+        chunk["output"] = pd.Series(outputs, index=chunk.index, dtype=object)
+        return chunk
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=config["max_workers"]) as executor:
+        try:
+            for chunk in chunks:
+                keys = batch_custom_ids(chunk, "filename", "segment").tolist()
+                futures = [executor.submit(task, p, t, k) for p, t, k in zip(chunk["prompt"], chunk["total_tokens"], keys)]
+                pending.append((chunk, keys, futures))
+                while pending and (len(pending) >= config["max_pending_chunks"] or all(f.done() for f in pending[0][2])):
+                    yield finish(*pending.popleft())
+            while pending:
+                yield finish(*pending.popleft())
+        except BaseException:
+            # on a failure without journal (or when the consumer stops) queued requests are not sent
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def _append_jsonl(df : pd.DataFrame, path : str):
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(df.to_json(orient="records", lines=True, force_ascii=False))
+
+
+def _append_csv(df : pd.DataFrame, path : str):
+    df.to_csv(path, mode="a", index=False, header=not os.path.isfile(path) or os.path.getsize(path) == 0)
+
+
+# Run the whole workflow of the notebook, files flow through in chunks so memory does not grow with the corpus
+def run_pipeline(config : dict, client : OpenAI = None, limit : int = None) -> dict:
+    """
+    # Stages
+        examples -> few shot context -> rows -> ingest (processes) -> segment -> prefilter
+            -> requests (threads, rate limited) -> outputs.jsonl, answers.csv
+        - ingestion, segmentation and prefiltering run in a background thread up to queue_size chunks ahead of
+          inference, so files are read and cleaned while earlier requests are in flight
+        - outputs.jsonl holds the compact output of every request, answers.csv the answer per document and source
+        - with inputs "examples" the answers are merged into the labels of the test examples at the end
+    """
+    paths = config["paths"]
+    recorder = telemetry.enable() if paths.get("telemetry") else None
+    counts = Counter()
+
+    prompt_df, test_df = load_examples(config)
+    system, user_assistant, base_token_length = build_context(prompt_df, config)
+    if config["flag_segmented"] and config["max_token_num"] - base_token_length <= config["overlay"]:
+        raise ValueError(f"max_token_num ({config['max_token_num']}) leaves no room for segments after the context "
+                         f"({base_token_length} tokens) and the overlay ({config['overlay']} tokens)")
+
+    rows = iter_rows(config, test_df)
+    if limit is not None:
+        rows = (row for _, row in zip(range(limit), rows))
+    chunks = iter_inputs(rows, config, base_token_length, counts)
+    if config["flag_prefilter"]:
+        index = prefilter.KeywordIndex(prefilter.build_term_weights(
+            util.det_commonly_used_terms(prompt_df["terms_audit"], min_ratio=config["min_ratio"]),
+            util.det_commonly_used_terms(prompt_df["terms_notes"], min_ratio=config["min_ratio"])))
+        chunks = iter_prefiltered(chunks, index, config["prefilter_threshold"], counts)
+
+    client = client if client is not None else OpenAI()
+    cache = ResponseCache(paths["cache"]) if paths.get("cache") else None
+    journal = RunJournal(paths["journal"]) if paths.get("journal") else None
+    for key in ("outputs", "answers"):
+        if paths.get(key) and os.path.isfile(paths[key]):
+            os.remove(paths[key])
+
+    all_answers = []
+    try:
+        with telemetry.stage("pipeline"):
+            for chunk in iter_completions(background(chunks, config["queue_size"]), client, system, user_assistant,
+                                          config, cache, journal, counts):
+                counts["chunks"] += 1
+                if paths.get("outputs"):
+                    id_columns = [c for c in ["filename", "segment"] if c in chunk.columns]
+                    _append_jsonl(chunk[id_columns].join(util.completions_frame(chunk["output"])), paths["outputs"])
+                answers = results.resolve_answers(results.parse_outputs(chunk), config["policy"])
+                counts["malformed"] += results.count_malformed(chunk)
+                if paths.get("answers"):
+                    _append_csv(answers, paths["answers"])
+                # answers are only kept for merging them into the labels of the (few) test examples
+                if config["inputs"] == "examples":
+                    all_answers.append(answers)
+    finally:
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.close()
+        if recorder is not None:
+            telemetry.disable()
+
+    answers = pd.concat(all_answers, ignore_index=True) if all_answers else pd.DataFrame(columns=results.RESULT_COLUMNS)
+    if config["inputs"] == "examples" and paths.get("labels"):
+        files = answers["filename"].unique() if limit is not None else test_df["filename"].unique()
+        labels = results.merge_labels(test_df[test_df["filename"].isin(files)].copy(), answers)
+        labels.to_csv(paths["labels"], index=False)
+
+    if recorder is not None:
+        recorder.export(paths["telemetry"])
+    return dict(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract accounting standards from financial statements without the notebook",
+                                     epilog="python -m utility.pipeline --config pipeline.yaml")
+    parser.add_argument("--config", help="yaml file overriding the default settings")
+    parser.add_argument("--limit", type=int, help="only process the first files")
+    parser.add_argument("--print-config", action="store_true", help="print the resolved settings and exit")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.print_config:
+        print(yaml.safe_dump(config, sort_keys=False))
+        return
+
+    _ = load_dotenv(find_dotenv())
+    summary = run_pipeline(config, limit=args.limit)
+    print(json.dumps(summary, indent=1))
+
+
+if __name__ == "__main__":
+    main()
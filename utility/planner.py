@@ -0,0 +1,158 @@
+import heapq
+import numpy as np
+import pandas as pd
+from .inference import TokenBucket
+
+# Prices in $ per 1k tokens, context window in tokens, rpm/tpm of the account's usage tier (override as needed)
+MODELS = {"gpt-3.5-turbo-0125": {"input": 0.0005, "output": 0.0015, "context": 16_385, "rpm": 10_000, "tpm": 1_000_000},
+          "gpt-4-0125-preview": {"input": 0.01, "output": 0.03, "context": 128_000, "rpm": 10_000, "tpm": 800_000}}
+
+# Seconds per request: (base + per_input_token * input + per_output_token * output) * lognormal(0, sigma)
+LATENCY = {"base": 0.5, "per_input_token": 5e-5, "per_output_token": 0.02, "sigma": 0.3}
+
+# get_completion gives up after 6 attempts, waiting wait_random_exponential(min=1, max=60) in between
+MAX_ATTEMPTS = 6
+ERROR_LATENCY = 0.5
+
+
+# Rows whose request and answer do not fit into the context window of model
+def validate_context(df : pd.DataFrame, model : str, max_output_tokens : int = 0, tokens_col : str = "total_tokens") -> pd.DataFrame:
+    return df[df[tokens_col] + max_output_tokens > MODELS[model]["context"]]
+
+
+def check_context(df : pd.DataFrame, model : str, max_output_tokens : int = 0, tokens_col : str = "total_tokens"):
+    too_long = validate_context(df, model, max_output_tokens, tokens_col)
+    if not too_long.empty:
+        raise ValueError(f"{len(too_long)} rows exceed the context window of {model} ({MODELS[model]['context']} tokens), "
+                         f"largest has {too_long[tokens_col].max()} tokens")
+
+
+def _sample_output_tokens(rng, output_tokens, num_segments : np.ndarray) -> np.ndarray:
+    if np.isscalar(output_tokens):
+        return rng.poisson(output_tokens * num_segments)
+    observed = np.asarray(pd.Series(output_tokens).dropna(), dtype=float)
+    return np.array([rng.choice(observed, n).sum() for n in num_segments])
+
+
+# Time at which inference.RateLimiter lets a request through, waiting exactly as long as both buckets need
+def _acquire(requests : TokenBucket, tokens : TokenBucket, now : float, num_tokens : int) -> float:
+    requests.refill(now)
+    tokens.refill(now)
+    now += max(requests.wait_time(1), tokens.wait_time(num_tokens))
+    requests.refill(now)
+    tokens.refill(now)
+    requests.consume(1)
+    tokens.consume(num_tokens)
+    return now
+
+
+# One simulated run of inference.run_prompts, returns wall-clock seconds and per request outcomes
+def simulate_run(input_tokens : np.ndarray,
+                 output_tokens : np.ndarray,
+                 rpm : float,
+                 tpm : float,
+                 max_workers : int = 16,
+                 cache_hit_rate : float = 0.0,
+                 error_rate : float = 0.0,
+                 latency : dict = LATENCY,
+                 observed_latency : np.ndarray = None,
+                 rng : np.random.Generator = None) -> tuple[float, np.ndarray, np.ndarray]:
+    """
+    # Simulation
+        - requests are taken up in order by max_workers workers, as by the executor of run_prompts
+        - cache hits return immediately, other requests wait for the rate limiter (same token buckets as
+          inference.RateLimiter) and then take a sampled latency, or one drawn from observed_latency
+        - each attempt fails with error_rate, failed attempts are retried with get_completion's backoff
+          and a request fails after MAX_ATTEMPTS attempts
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    requests, tokens = TokenBucket(rpm), TokenBucket(tpm)
+    requests.updated = tokens.updated = 0.0
+    workers = [0.0] * max_workers
+
+    n = len(input_tokens)
+    hits = rng.random(n) < cache_hit_rate
+    succeeded = np.ones(n, dtype=bool)
+    if observed_latency is not None:
+        latencies = rng.choice(observed_latency, n)
+    else:
+        latencies = (latency["base"] + latency["per_input_token"] * input_tokens + latency["per_output_token"] * output_tokens) \
+                    * rng.lognormal(0, latency["sigma"], n)
+
+    end = 0.0
+    for i in range(n):
+        now = heapq.heappop(workers)
+        if not hits[i]:
+            now = _acquire(requests, tokens, now, input_tokens[i])
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                if rng.random() >= error_rate:
+                    now += latencies[i]
+                    break
+                now += ERROR_LATENCY
+                if attempt == MAX_ATTEMPTS:
+                    succeeded[i] = False
+                else:
+                    now += rng.uniform(1, min(2 ** (attempt - 1), 60))
+        end = max(end, now)
+        heapq.heappush(workers, now)
+
+    return end, hits, succeeded
+
+
+# Cost and wall-clock estimates of sending requests (df_inputs or packing.pack_segments' packs) to model
+def plan_run(requests : pd.DataFrame,
+             model : str = "gpt-3.5-turbo-0125",
+             rpm : float = None,
+             tpm : float = None,
+             max_workers : int = 16,
+             cache_hit_rate : float = 0.0,
+             error_rate : float = 0.0,
+             output_tokens = 100,
+             latency : dict = LATENCY,
+             observed_latency : pd.Series = None,
+             num_simulations : int = 20,
+             percentiles : tuple[int] = (5, 50, 95),
+             tokens_col : str = "total_tokens",
+             validate : bool = True,
+             seed : int = 0) -> pd.DataFrame:
+    """
+    # Inputs
+        - output_tokens: expected answer tokens per segment, or observed completion tokens to sample from
+          (e.g. util.completions_frame(outputs)['completion_tokens'] of an earlier run)
+        - observed_latency: observed request latencies to sample from instead of the latency model
+        - packed requests (with a num_segments column) expect one answer per segment
+    # Returns
+        - mean and percentiles over num_simulations simulated runs of requests, cache hits, failed requests,
+          billed input and output tokens, $ and minutes
+    """
+    spec = MODELS[model]
+    rpm = rpm if rpm else spec["rpm"]
+    tpm = tpm if tpm else spec["tpm"]
+    if validate:
+        check_context(requests, model, 0, tokens_col)
+
+    rng = np.random.default_rng(seed)
+    input_tokens = requests[tokens_col].to_numpy()
+    num_segments = requests["num_segments"].to_numpy() if "num_segments" in requests.columns else np.ones(len(requests), dtype=int)
+    observed_latency = np.asarray(observed_latency.dropna(), dtype=float) if observed_latency is not None else None
+
+    runs = []
+    for _ in range(num_simulations):
+        outputs = _sample_output_tokens(rng, output_tokens, num_segments)
+        seconds, hits, succeeded = simulate_run(input_tokens, outputs, rpm, tpm, max_workers, cache_hit_rate, error_rate,
+                                                latency, observed_latency, rng)
+        billed = ~hits & succeeded
+        billed_input, billed_output = int(input_tokens[billed].sum()), int(outputs[billed].sum())
+        runs.append({"requests": len(requests),
+                     "cache hits": int(hits.sum()),
+                     "failed": int((~succeeded).sum()),
+                     "input tokens": billed_input,
+                     "output tokens": billed_output,
+                     "$ (excl. VAT)": billed_input / 1000 * spec["input"] + billed_output / 1000 * spec["output"],
+                     "minutes": seconds / 60})
+
+    runs = pd.DataFrame(runs)
+    report = pd.DataFrame({"mean": runs.mean()})
+    for p in percentiles:
+        report[f"p{p}"] = runs.quantile(p / 100)
+    return report
@@ -0,0 +1,96 @@
+import re
+import pandas as pd
+
+# Names under which accounting standards appear in statements
+STANDARD_TERMS = [
+    "IFRS", "IFRSs", "International Financial Reporting Standards", "International Financial Reporting Standard",
+    "IAS", "International Accounting Standards", "IASB", "GAAP", "US GAAP", "UK GAAP",
+    "Generally Accepted Accounting Principles", "Generally Accepted Accounting Practice",
+    "accounting principles generally accepted", "Financial Reporting Standards", "FRS", "FRS 102", "FRSSE",
+    "accounting standards", "Accounting Standards Board", "FASB", "HGB", "Companies Act",
+]
+
+
+# Weight per term, standard names weigh more than the terms commonly found around them
+def build_term_weights(terms_audit : dict[str,int] = None,
+                       terms_notes : dict[str,int] = None,
+                       standard_terms : list[str] = STANDARD_TERMS,
+                       standard_weight : float = 3.0,
+                       term_weight : float = 1.0) -> dict[str,float]:
+    weights = {}
+    for terms in (terms_audit or {}, terms_notes or {}):
+        for term in terms:
+            term = term.strip()
+            if term:
+                weights[term.lower()] = term_weight
+    for term in standard_terms:
+        weights[term.lower()] = standard_weight
+    return weights
+
+
+# Single pattern over all terms, a segment scores the summed weight of the distinct terms it contains
+class KeywordIndex:
+    """
+    # Scoring
+        - terms are matched case insensitive and not within words
+        - each distinct term counts once, so a segment scores at least as high as the paragraphs it contains
+          (up to overlapping matches) and recall measured on labelled paragraphs approximates recall on segments
+    """
+
+    def __init__(self, term_weights : dict[str,float]):
+        self.term_weights = {t.lower(): w for t, w in term_weights.items()}
+        terms = sorted(self.term_weights, key=len, reverse=True)
+        self.pattern = re.compile(r"(?<!\w)(?:" + "|".join(re.escape(t) for t in terms) + r")(?!\w)", re.IGNORECASE)
+
+    def matches(self, text : str) -> set[str]:
+        if not isinstance(text, str):
+            return set()
+        return {m.lower() for m in self.pattern.findall(text)}
+
+    def score(self, text : str) -> float:
+        return sum(self.term_weights[t] for t in self.matches(text))
+
+    def score_series(self, texts : pd.Series) -> pd.Series:
+        return texts.map(self.score).astype(float)
+
+
+# Keep segments scoring at least threshold, optionally the best min_per_document segments of every document
+def prefilter_segments(df : pd.DataFrame,
+                       index : KeywordIndex,
+                       threshold : float = 3.0,
+                       id_col : str = "filename",
+                       prompt_col : str = "prompt",
+                       min_per_document : int = 0) -> tuple[pd.DataFrame, dict]:
+    scores = index.score_series(df[prompt_col])
+    keep = scores >= threshold
+
+    if min_per_document > 0:
+        rank = scores.groupby(df[id_col]).rank(method="first", ascending=False)
+        keep |= rank <= min_per_document
+
+    filtered = df[keep].copy()
+    filtered["keyword_score"] = scores[keep]
+
+    stats = {"segments": len(df),
+             "segments_kept": int(keep.sum()),
+             "documents": df[id_col].nunique(),
+             "documents_kept": filtered[id_col].nunique()}
+    if "total_tokens" in df.columns:
+        stats["tokens"] = int(df["total_tokens"].sum())
+        stats["tokens_kept"] = int(filtered["total_tokens"].sum())
+    return filtered, stats
+
+
+# Share of labelled paragraphs that would pass the prefilter, per source and overall
+def prefilter_recall(examples : pd.DataFrame,
+                     index : KeywordIndex,
+                     threshold : float = 3.0,
+                     text_col : str = "paragraph (context)",
+                     source_col : str = "source") -> pd.DataFrame:
+    examples = examples.dropna(subset=[text_col])
+    passed = index.score_series(examples[text_col].astype(str)) >= threshold
+
+    report = passed.groupby(examples[source_col]).agg(["size", "sum", "mean"])
+    report.loc["all"] = [passed.size, passed.sum(), passed.mean() if passed.size else float("nan")]
+    report.columns = ["examples", "passed", "recall"]
+    return report.astype({"examples": "int64", "passed": "int64"})
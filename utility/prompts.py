@@ -135,4 +135,26 @@ audit part or the notes part.
 4) Extract the desired term.
 5) Double check that the term you extract is actually contained in the provided segment.
 6) List both the term, the sentence, and what part you extracted the term from.
-"""
\ No newline at end of file
+"""
+
+# Packed requests :::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+## Several segments in one request, delimited by <segment id="..."><\segment> tags
+task_descr_packed = """
+The text you are provided with consists of several segments, each delimited by tags (<segment id="..."></segment>). \
+The segments can stem from different financial statements, treat every segment on its own.
+"""
+
+answer_format_packed = """
+Answer with a single JSON object that has one entry per segment, keyed by the id of the segment. \
+The value of each entry follows the answer format given above, for example:
+{
+"<segment id>" : {
+    "audit" : {
+        "sentence" : "sentence from which you extracted the standard contained in the auditor section",
+        "term" : "accounting standard you found in the auditor section"}
+    },
+"<other segment id>" : {
+    "no info": "no answer"
+    }
+}
+"""
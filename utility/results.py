@@ -0,0 +1,103 @@
+import json
+import re
+import pandas as pd
+
+RESULT_COLUMNS = ["filename", "segment", "source", "sentence", "term"]
+
+_code_fence = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+# Message content of a model output (ChatCompletion, compact record or plain string)
+def output_content(output) -> str:
+    if output is None or isinstance(output, str):
+        return output
+    if isinstance(output, dict):
+        return output.get("content")
+    try:
+        return output.choices[0].message.content
+    except (AttributeError, IndexError):
+        return None
+
+
+# Parse a json answer, tolerating code fences and text around the object, None if it is not json
+def parse_json(content : str) -> dict:
+    if not isinstance(content, str):
+        return None
+    content = _code_fence.sub("", content.strip())
+    try:
+        parsed = json.loads(content)
+    except ValueError:
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        try:
+            parsed = json.loads(content[start:end + 1])
+        except ValueError:
+            return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+# Long table with one row per extracted (source, sentence, term) of every output
+def parse_outputs(df : pd.DataFrame, output_col : str = "output", id_col : str = "filename", segment_col : str = "segment") -> pd.DataFrame:
+    segments = df[segment_col] if segment_col in df.columns else [0] * len(df)
+    records = []
+    for filename, segment, output in zip(df[id_col], segments, df[output_col]):
+        parsed = parse_json(output_content(output))
+        if parsed is None:
+            continue
+        for source, answer in parsed.items():
+            if not isinstance(answer, dict) or not answer.get("term"):
+                continue
+            records.append((filename, segment, source, answer.get("sentence"), str(answer["term"]).strip()))
+
+    long = pd.DataFrame.from_records(records, columns=RESULT_COLUMNS)
+    long["segment"] = long["segment"].astype("int64")
+    return long
+
+
+# Number of outputs that could not be parsed
+def count_malformed(df : pd.DataFrame, output_col : str = "output") -> int:
+    return int(sum(parse_json(output_content(o)) is None for o in df[output_col]))
+
+
+# One answer per document and source
+def resolve_answers(long : pd.DataFrame, policy : str = "first") -> pd.DataFrame:
+    """
+    # Policies
+        - first: answer of the earliest segment
+        - last: answer of the latest segment
+        - most_common: most frequent term, ties go to the earliest segment
+        - all: all distinct terms (and their sentences) joined by " | " in segment order
+    """
+    keys = ["filename", "source"]
+    long = long.sort_values(keys + ["segment"], kind="stable")
+
+    if policy == "first":
+        resolved = long.drop_duplicates(keys, keep="first")
+    elif policy == "last":
+        resolved = long.drop_duplicates(keys, keep="last")
+    elif policy == "most_common":
+        counts = long.groupby(keys + ["term"], sort=False)["term"].transform("size")
+        resolved = long.assign(count=counts).sort_values(keys + ["count", "segment"], ascending=[True, True, False, True],
+                                                         kind="stable").drop_duplicates(keys).drop(columns="count")
+    elif policy == "all":
+        unique = long.drop_duplicates(keys + ["term"])
+        resolved = unique.groupby(keys, sort=False).agg(segment=("segment", "min"),
+                                                          sentence=("sentence", lambda s: " | ".join(map(str, s))),
+                                                          term=("term", " | ".join)).reset_index()
+    else:
+        raise ValueError(f"Unknown policy: {policy}")
+
+    return resolved[RESULT_COLUMNS].reset_index(drop=True)
+
+
+# Attach resolved answers to labels with a single join
+def merge_labels(labels : pd.DataFrame, answers : pd.DataFrame, id_col : str = "filename", source_col : str = "source") -> pd.DataFrame:
+    answers = answers.rename(columns={"filename": id_col, "source": source_col,
+                                      "sentence": "found_sentence", "term": "found_term", "segment": "found_segment"})
+    labels = labels.drop(columns=["found_sentence", "found_term", "found_segment"], errors="ignore")
+    merged = labels.merge(answers, on=[id_col, source_col], how="left")
+    merged.index = labels.index
+    merged[["found_sentence", "found_term"]] = merged[["found_sentence", "found_term"]].fillna("")
+    merged["found_segment"] = merged["found_segment"].astype("Int64")
+    return merged
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pandas as pd
+from openai import OpenAI
+from tqdm.auto import tqdm
+from . import utility as util
+from .inference import RateLimiter, request_completion
+from .results import output_content, parse_json
+
+SOURCES = ("notes", "audit")
+
+
+# Sources of an output with a non-empty term
+def found_sources(output) -> set[str]:
+    parsed = parse_json(output_content(output))
+    if parsed is None:
+        return set()
+    return {source for source, answer in parsed.items() if isinstance(answer, dict) and answer.get("term")}
+
+
+# Rank of every segment within its document, lower ranks are dispatched first
+def segment_priority(df : pd.DataFrame,
+                     order : str = "interleave",
+                     id_col : str = "filename",
+                     segment_col : str = "segment",
+                     score_col : str = "keyword_score") -> pd.Series:
+    """
+    # Orders
+        - position: segments in document order
+        - interleave: first, last, second, second to last, ... as the notes usually start near the beginning
+          of a statement and the auditor section is usually found near its end
+        - score: highest score_col first (e.g. prefilter.KeywordIndex scores), ties in interleave order
+    """
+    segments = df[segment_col] if segment_col in df.columns else pd.Series(0, index=df.index)
+    position = segments.groupby(df[id_col]).rank(method="first").astype("int64") - 1
+    if order == "position":
+        return position
+
+    n = df.groupby(id_col)[id_col].transform("size")
+    from_end = n - 1 - position
+    interleave = 2 * np.minimum(position, from_end) + (position > from_end).astype("int64")
+    if order == "interleave":
+        return interleave
+    if order == "score":
+        keys = pd.DataFrame({"id": df[id_col], "score": -df[score_col].fillna(0), "interleave": interleave})
+        return keys.sort_values(["id", "score", "interleave"], kind="stable").groupby("id").cumcount().reindex(df.index)
+    raise ValueError(f"Unknown order: {order}")
+
+
+# Query the segments of every document in priority order, stop a document once all sources are found
+def prompt_gpt_documents(client : OpenAI,
+                         system : str,
+                         df : pd.DataFrame,
+                         user_assistant : list[tuple[str,str]] = None,
+                         model : str = "gpt-3.5-turbo-0125",
+                         temp = 0,
+                         order : str = "interleave",
+                         sources : tuple[str] = SOURCES,
+                         per_document : int = 1,
+                         prompt_col : str = "prompt",
+                         tokens_col : str = "total_tokens",
+                         id_col : str = "filename",
+                         segment_col : str = "segment",
+                         score_col : str = "keyword_score",
+                         max_workers : int = 16,
+                         rpm : int = 10_000,
+                         tpm : int = 1_000_000,
+                         progress : bool = True,
+                         cache = None,
+                         compact : bool = False) -> tuple[pd.Series, pd.DataFrame]:
+    """
+    # Scheduling
+        - every document has up to per_document segments in flight, a finished segment dispatches the next one
+        - once the outputs of a document contain a non-empty term for every source, its remaining segments are
+          not sent, queued requests are cancelled and requests already in flight are kept
+        - a request that still fails after get_completion's retries ends the run, queued requests are cancelled
+          and only the ones in flight finish
+        - requests go through inference.request_completion, so the rate limiter, cache and compact options behave
+          as in inference.run_prompts (cached requests are answered without waiting for the rate limiter)
+    # Returns
+        - outputs aligned with df (None for segments that were not sent)
+        - per document: segments, calls, calls_saved, sources found and whether the document was completed
+    """
+    tokens = df[tokens_col] if tokens_col in df.columns else df[prompt_col].map(util.count_tokens)
+    priority = segment_priority(df, order, id_col, segment_col, score_col)
+    ordered = pd.DataFrame({"id": df[id_col], "priority": priority, "row": np.arange(len(df))})
+    ordered = ordered.sort_values(["id", "priority"], kind="stable")
+    queues = {doc: list(rows) for doc, rows in ordered.groupby("id", sort=False)["row"]}
+
+    prompts = df[prompt_col].tolist()
+    tokens = tokens.tolist()
+    limiter = RateLimiter(rpm, tpm)
+    outputs = [None] * len(df)
+    found = {doc: set() for doc in queues}
+    calls = dict.fromkeys(queues, 0)
+    in_flight = {doc: set() for doc in queues}
+
+    def task(row):
+        return request_completion(client, system, prompts[row], user_assistant, model, temp, tokens[row], limiter, cache, compact)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm(total=len(df), disable=not progress) as bar:
+        futures = {}
+
+        def dispatch(doc):
+            while queues[doc] and len(in_flight[doc]) < per_document:
+                row = queues[doc].pop(0)
+                future = executor.submit(task, row)
+                futures[future] = (doc, row)
+                in_flight[doc].add(future)
+
+        for doc in queues:
+            dispatch(doc)
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                doc, row = futures.pop(future)
+                in_flight[doc].discard(future)
+                bar.update()
+                if future.cancelled():
+                    continue
+                try:
+                    outputs[row] = future.result()
+                except Exception:
+                    # queued requests would otherwise all be sent (and retried) before the error surfaces
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+                calls[doc] += 1
+                found[doc] |= found_sources(outputs[row]) & set(sources)
+
+                if found[doc] >= set(sources):
+                    bar.update(len(queues[doc]))
+                    queues[doc] = []
+                    for pending in list(in_flight[doc]):
+                        pending.cancel()
+                else:
+                    dispatch(doc)
+
+    segments = ordered.groupby("id", sort=False).size()
+    stats = pd.DataFrame({"segments": segments,
+                          "calls": pd.Series(calls),
+                          "found": pd.Series({doc: ", ".join(sorted(s)) for doc, s in found.items()}),
+                          "complete": pd.Series({doc: s >= set(sources) for doc, s in found.items()})})
+    stats.insert(2, "calls_saved", stats["segments"] - stats["calls"])
+    stats.index.name = id_col
+    return pd.Series(outputs, index=df.index, dtype=object), stats
@@ -0,0 +1,172 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import openai
+import pandas as pd
+
+# Upper edges of the latency histogram buckets in seconds, the last bucket is unbounded
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+_disabled = nullcontext()
+_telemetry = None
+
+
+# Stage timings, API call latencies and token counts, and retries of a run
+class Telemetry:
+    """
+    # Stages
+        - wall and cpu (of the calling thread) seconds summed over all calls of a stage, so stages run in
+          several threads or processes can sum to more than the elapsed time
+        - items are stage specific (characters for ingest.* and clean_text.*)
+    # Calls
+        - latency of every successful get_completion attempt with its prompt and completion tokens
+    # Retries
+        - attempts retried by get_completion per reason (rate_limit, server_error, timeout, connection,
+          client_error, other) and the backoff slept
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.latencies = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = {}
+
+    def add_stage(self, name : str, wall : float, cpu : float, count : int = 1, items : int = 0):
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0, 0])
+            stage[0] += count
+            stage[1] += wall
+            stage[2] += cpu
+            stage[3] += items
+
+    def merge_stages(self, stages : dict):
+        for name, (count, wall, cpu, items) in stages.items():
+            self.add_stage(name, wall, cpu, count, items)
+
+    @contextmanager
+    def stage(self, name : str, items : int = 0):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - wall, time.thread_time() - cpu, 1, items)
+
+    def record_call(self, latency : float, usage = None):
+        with self.lock:
+            self.latencies.append(latency)
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens
+                self.completion_tokens += usage.completion_tokens
+
+    def record_retry(self, reason : str, backoff : float):
+        with self.lock:
+            retry = self.retries.setdefault(reason, [0, 0.0])
+            retry[0] += 1
+            retry[1] += backoff
+
+    def report(self) -> dict:
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            stages = {name: {"count": count, "wall": wall, "cpu": cpu, "items": items,
+                             "items_per_second": items / wall if items and wall else None}
+                      for name, (count, wall, cpu, items) in self.stages.items()}
+
+            latencies = np.asarray(self.latencies)
+            edges = np.asarray(LATENCY_BUCKETS + (np.inf,))
+            counts = np.bincount(np.searchsorted(edges, latencies), minlength=len(edges)) if latencies.size else np.zeros(len(edges), int)
+            labels = [f"<={e}s" for e in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+            # throughput over the inference stage if it was recorded, otherwise over the whole run
+            seconds = self.stages["inference"][1] if "inference" in self.stages else elapsed
+            tokens = self.prompt_tokens + self.completion_tokens
+            calls = {"count": int(latencies.size),
+                     "prompt_tokens": self.prompt_tokens,
+                     "completion_tokens": self.completion_tokens,
+                     "tokens_per_second": tokens / seconds if seconds else None,
+                     "latency_mean": float(latencies.mean()) if latencies.size else None,
+                     **{f"latency_p{p}": float(np.percentile(latencies, p)) if latencies.size else None for p in (50, 90, 95, 99)},
+                     "latency_max": float(latencies.max()) if latencies.size else None,
+                     "latency_histogram": dict(zip(labels, counts.tolist()))}
+
+            retries = {reason: {"count": count, "backoff": backoff} for reason, (count, backoff) in self.retries.items()}
+        return {"elapsed": elapsed, "stages": stages, "calls": calls, "retries": retries}
+
+    # Flat table with one row per (section, name, metric)
+    def report_frame(self) -> pd.DataFrame:
+        report = self.report()
+        rows = [("run", "run", "elapsed", report["elapsed"])]
+        for section in ("stages", "retries"):
+            rows += [(section, name, metric, value) for name, metrics in report[section].items() for metric, value in metrics.items()]
+        for metric, value in report["calls"].items():
+            if isinstance(value, dict):
+                rows += [("calls", metric, bucket, count) for bucket, count in value.items()]
+            else:
+                rows.append(("calls", "calls", metric, value))
+        return pd.DataFrame.from_records(rows, columns=["section", "name", "metric", "value"])
+
+    # JSON report, or the flat table for paths ending in .csv
+    def export(self, path : str):
+        if path.endswith(".csv"):
+            self.report_frame().to_csv(path, index=False)
+        else:
+            with open(path, "w") as file:
+                json.dump(self.report(), file, indent=1)
+
+
+# Recording is off until enabled, instrumented code then only checks a module global
+def enable() -> Telemetry:
+    global _telemetry
+    _telemetry = Telemetry()
+    return _telemetry
+
+
+def disable() -> Telemetry:
+    global _telemetry
+    telemetry, _telemetry = _telemetry, None
+    return telemetry
+
+
+def get() -> Telemetry:
+    return _telemetry
+
+
+def enabled() -> bool:
+    return _telemetry is not None
+
+
+def stage(name : str, items : int = 0):
+    if _telemetry is None:
+        return _disabled
+    return _telemetry.stage(name, items)
+
+
+def merge_stages(stages : dict):
+    if _telemetry is not None and stages:
+        _telemetry.merge_stages(stages)
+
+
+def record_call(latency : float, usage = None):
+    if _telemetry is not None:
+        _telemetry.record_call(latency, usage)
+
+
+def retry_reason(error) -> str:
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.APIStatusError):
+        return "server_error" if error.status_code >= 500 else "client_error"
+    return "other"
+
+
+# before_sleep callback of tenacity.retry
+def record_retry(retry_state):
+    if _telemetry is not None:
+        _telemetry.record_retry(retry_reason(retry_state.outcome.exception()), retry_state.next_action.sleep)
@@ -0,0 +1,74 @@
+from functools import lru_cache
+import numpy as np
+from tiktoken import Encoding, get_encoding
+
+
+# Encoders are expensive to construct, load each one once per process
+@lru_cache(maxsize=None)
+def get_encoder(encoding : str = "cl100k_base") -> Encoding:
+    return get_encoding(encoding)
+
+
+# Overlaying (start, end) token windows, each at most max_tokens long
+def segment_windows(num_tokens : int, max_tokens : int, overlay : int) -> list[tuple[int,int]]:
+    start = 0
+    windows = []
+    while start + max_tokens <= num_tokens:
+        windows.append((start, start + max_tokens))
+        start += max_tokens - overlay
+    windows.append((start, num_tokens))
+    return windows
+
+
+# Text encoded once, segments and token counts are derived from the token array
+class TokenizedDocument:
+    def __init__(self, text : str, tokens, encoding : str = "cl100k_base"):
+        self.text = text
+        self.tokens = np.asarray(tokens, dtype=np.uint32)
+        self.encoding = encoding
+
+    @classmethod
+    def from_text(cls, text : str, encoding : str = "cl100k_base") -> "TokenizedDocument":
+        return cls(text, get_encoder(encoding).encode(text), encoding)
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.tokens)
+
+    def decode(self, start : int = 0, end : int = None) -> str:
+        return get_encoder(self.encoding).decode(self.tokens[start:end].tolist())
+
+    def windows(self, max_tokens : int, overlay : int) -> list[tuple[int,int]]:
+        return segment_windows(self.num_tokens, max_tokens, overlay)
+
+    # Character offsets into text for token positions, decodes each token once
+    def char_offsets(self, positions : list[int]) -> dict[int,int]:
+        encoder = get_encoder(self.encoding)
+        offsets = {}
+        chars = 0
+        last = 0
+        for position in sorted(set(positions)):
+            chunk = np.frombuffer(encoder.decode_bytes(self.tokens[last:position].tolist()), dtype=np.uint8)
+            # count utf-8 start bytes, continuation bytes are 10xxxxxx
+            chars += int(np.count_nonzero((chunk & 0xC0) != 0x80))
+            offset = chars
+            # a token starting inside a multibyte character maps to that character (as in Encoding.decode_with_offsets)
+            if position < self.num_tokens and 0x80 <= encoder.decode_single_token_bytes(int(self.tokens[position]))[0] < 0xC0:
+                offset -= 1
+            offsets[position] = max(0, offset)
+            last = position
+        return offsets
+
+    # Segment texts together with their token counts
+    def segments(self, max_tokens : int, overlay : int) -> list[tuple[str,int]]:
+        return [(self.decode(start, end), end - start) for start, end in self.windows(max_tokens, overlay)]
+
+
+# Encode several documents at once, tiktoken releases the GIL so threads run in parallel
+def encode_batch(texts : list[str], encoding : str = "cl100k_base", num_threads : int = 8) -> list[TokenizedDocument]:
+    texts = list(texts)
+    tokens = get_encoder(encoding).encode_batch(texts, num_threads=num_threads)
+    return [TokenizedDocument(text, t, encoding) for text, t in zip(texts, tokens)]
@@ -1,11 +1,11 @@
 import os
 import json
 import re
+import time
 from math import ceil
 import pandas as pd
 import numpy as np
 from collections import Counter
-from tiktoken import get_encoding
 from openai import OpenAI
 from datetime import datetime
 from tenacity import (
@@ -14,9 +14,13 @@ from tenacity import (
     wait_random_exponential,
 )
 from . import text_cleaning as tc
+from . import tokenization as tok
+from . import ingestion
+from . import telemetry
+from . import fewshot
 
 
-# Estimates for pricing and compute time
+# Rough estimates for pricing and compute time (planner.plan_run simulates a run from the actual token distribution)
 def calc_price_gpt(num_files, avg_tok_size, num_segments, price, tokens_per_price = 1000):
     price = num_files * num_segments * avg_tok_size / tokens_per_price * price
     return {"$ (excl. VAT)":price}
@@ -31,81 +35,82 @@ def calc_compute_time(num_files, avg_tok_size, num_segments, tokens_per_minute):
 
 # Estimate for token number
 def count_tokens(text : str, encoding :str = "cl100k_base") -> int:
-    encoding = get_encoding(encoding)
-    return len(encoding.encode(text))
+    return len(tok.get_encoder(encoding).encode(text))
 
 # Read text and check for empty files
 def parse_txt(file_path : str) -> str:
-    res = None
-    # first check whether file exists
-    if os.path.isfile(file_path):
-        try:
-            with open(file_path, "r") as file:
-                res = file.read()
-        except UnicodeDecodeError:
-            return None
-        else:
-            # checks whether text contains words temporary solution
-            # data should be cleaned before creating datasets
-            pattern = re.compile(r'\w+')
-            if not bool(re.search(pattern, res)):
-                return None
-    return res
+    text, _ = ingestion.read_txt(file_path)
+    return text
 
 # Prep Inputs
-def prep_inputs(raw_df, filepath_col, id_col, coi, base_token_length, flag_segment, max_token_num, overlay, encoding = "cl100k_base"):
+# files are read, cleaned and tokenized in chunk_size chunks across num_workers processes (default: all cores),
+# files that are missing, undecodable or contain no words are dropped and counted in input_df.attrs['ingest_counts']
+def prep_inputs(raw_df, filepath_col, id_col, coi, base_token_length, flag_segment, max_token_num, overlay, encoding = "cl100k_base",
+                num_workers = None, chunk_size = 64):
 
     input_df = raw_df[coi].copy().drop_duplicates()
-    input_df['prompt'] = input_df[filepath_col].apply(parse_txt).apply(tc.clean_text)
-    input_df['prompt_tokens'] = input_df['prompt'].apply(count_tokens)
+    with telemetry.stage("ingest"):
+        results, counts = ingestion.ingest_files(input_df[filepath_col], encoding, num_workers, chunk_size, keep_tokens=flag_segment)
+
+    input_df = inputs_from_results(input_df, results, id_col, base_token_length, flag_segment, max_token_num, overlay, encoding)
+    input_df.attrs['ingest_counts'] = dict(counts)
+    return input_df
+
+# Inputs from the ingestion results of the rows of input_df (in the same order), rows of files that could not be used are dropped
+def inputs_from_results(input_df, results, id_col, base_token_length, flag_segment, max_token_num, overlay, encoding = "cl100k_base"):
+
+    # each document is encoded once, segmentation reuses the tokens
+    input_df = input_df.copy()
+    input_df['prompt'] = [r['prompt'] for r in results]
+    input_df['prompt_tokens'] = [r['prompt_tokens'] for r in results]
+    input_df = input_df[[r['status'] == "ok" for r in results]].copy()
     input_df['total_tokens'] = input_df['prompt_tokens'] + base_token_length
 
     if flag_segment:
-        input_df = segment_text_column(input_df, id_col, max_token_num, overlay, base_token_length, encoding)
+        documents = [tok.TokenizedDocument(r['prompt'], r['tokens'], encoding) for r in results if r['status'] == "ok"]
+        input_df = segment_text_column(input_df, id_col, max_token_num, overlay, base_token_length, encoding, documents)
 
     return input_df
 
 
 # Create overlaying segments for text
-def segment_text_column(raw_df, id_col, max_tokens, overlay, context_num_tokens, encoding):
-
-    result_df = pd.DataFrame()
-    raw_df = raw_df.copy()
-    
-    for index in raw_df.index:
-        row = raw_df.loc[index].copy()
-        prompt = raw_df.loc[index]['prompt']
-        raw_df.drop(index, inplace = True)
-
-        segments = segment_text(prompt, max_tokens-context_num_tokens, overlay, encoding)
-        
-        for i, s in enumerate(segments):
-            i_row = row.copy()
-            i_row["segment"] = str(i)
-            i_row["prompt"] = s
-            i_row = pd.DataFrame([i_row])
-            result_df = pd.concat([result_df, i_row], ignore_index=True)
-
-    result_df["prompt_tokens"] = result_df["prompt"].apply(count_tokens)
+# documents: optional tok.TokenizedDocument per row of raw_df, avoids encoding the prompts again
+# token_start/token_end and char_start/char_end locate each segment within its source document
+def segment_text_column(raw_df, id_col, max_tokens, overlay, context_num_tokens, encoding, documents = None):
+
+    if documents is None:
+        with telemetry.stage("segment.tokenize"):
+            documents = tok.encode_batch(raw_df['prompt'], encoding)
+
+    # one record per segment, the table is built once at the end
+    records = []
+    with telemetry.stage("segment"):
+        for row, document in zip(raw_df.to_dict('records'), documents):
+            windows = document.windows(max_tokens-context_num_tokens, overlay)
+            offsets = document.char_offsets([p for window in windows for p in window])
+
+            for i, (start, end) in enumerate(windows):
+                record = row.copy()
+                record["prompt"] = document.decode(start, end)
+                record["prompt_tokens"] = end - start
+                record["segment"] = i
+                record["token_start"] = start
+                record["token_end"] = end
+                record["char_start"] = offsets[start]
+                record["char_end"] = offsets[end]
+                records.append(record)
+
+    columns = list(dict.fromkeys(list(raw_df.columns) + ["prompt", "prompt_tokens", "segment",
+                                                         "token_start", "token_end", "char_start", "char_end"]))
+    result_df = pd.DataFrame.from_records(records, columns=columns)
+    result_df = result_df.astype({c: "int64" for c in ["prompt_tokens", "segment", "token_start", "token_end", "char_start", "char_end"]})
     result_df["total_tokens"] = result_df["prompt_tokens"] + context_num_tokens
 
     return result_df
 
 def segment_text(text, max_tokens, overlay, encoding :str = "cl100k_base"):
-    tokens_ = 0
-    indexes = []
-    text_token_len = count_tokens(text)
-    while tokens_ + max_tokens <= text_token_len:
-        indexes.append((tokens_, max_tokens+tokens_))
-        tokens_ += max_tokens - overlay
-    indexes.append((tokens_, text_token_len))
-
-    encoder = get_encoding(encoding)
-    encoded_text = encoder.encode(text)
-        
-    segments = [encoder.decode(encoded_text[index[0]:index[1]]) for index in indexes]    
-
-    return segments
+    document = tok.TokenizedDocument.from_text(text, encoding)
+    return [s for s, _ in document.segments(max_tokens, overlay)]
 
 # Commonly used terms section
 def det_commonly_used_terms(terms : pd.Series, delimiter = "|", min_ratio : float = .40) -> dict[str,int]:
@@ -123,7 +128,7 @@ def concat_terms(terms : dict[str,int], delimiter = " - ") -> str:
 
 
 #Call API
-@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
+@retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6), before_sleep=telemetry.record_retry)
 def get_completion(client : OpenAI, messages : dict[str,str], model : str = "gpt-3.5-turbo-0125", temp = 0):
     """
     # Available Models: https://platform.openai.com/docs/models/overview
@@ -137,7 +142,9 @@ def get_completion(client : OpenAI, messages : dict[str,str], model : str = "gpt
             
         -> response.choices[0].finish_reason
     """
+    start = time.perf_counter()
     response = client.chat.completions.create(model=model, messages=messages, temperature=temp)
+    telemetry.record_call(time.perf_counter() - start, response.usage)
     return response
 
 
@@ -168,13 +175,63 @@ def prompt_gpt(client : OpenAI,
                prompt : str, 
                user_assistant : list[tuple[str,str]] = None, 
                model : str = "gpt-3.5-turbo-0125", 
-               temp = 0):
+               temp = 0,
+               cache = None,
+               compact : bool = False):
 
     messages = create_messages_context_gpt(system, prompt, user_assistant)
-    output = get_completion(client, messages, model, temp)
+    start = time.perf_counter()
+
+    # identical requests are answered from the response cache (see cache.ResponseCache)
+    if cache is not None:
+        key = cache.make_key(model, messages, temp)
+        output = cache.get(key)
+        if output is None:
+            output = get_completion(client, messages, model, temp)
+            cache.put(key, model, output)
+    else:
+        output = get_completion(client, messages, model, temp)
+
+    if compact:
+        return compact_completion(output, time.perf_counter() - start)
     return output
 
 
+# Compact record of a completion, a fraction of the size of the full response object
+COMPLETION_DTYPES = {"content": "string",
+                     "finish_reason": "category",
+                     "prompt_tokens": "Int64",
+                     "completion_tokens": "Int64",
+                     "latency": "float64",
+                     "model": "category"}
+
+def compact_completion(response, latency : float = None) -> dict:
+    choice = response.choices[0]
+    usage = response.usage
+    return {"content": choice.message.content,
+            "finish_reason": choice.finish_reason,
+            "prompt_tokens": usage.prompt_tokens if usage else None,
+            "completion_tokens": usage.completion_tokens if usage else None,
+            "latency": latency,
+            "model": response.model}
+
+# Typed columns from completions or compact records
+def completions_frame(outputs, index = None) -> pd.DataFrame:
+    if isinstance(outputs, pd.Series) and index is None:
+        index = outputs.index
+    records = [o if isinstance(o, dict) or o is None else compact_completion(o) for o in outputs]
+    records = [r if r is not None else {} for r in records]
+    frame = pd.DataFrame.from_records(records, columns=list(COMPLETION_DTYPES), index=index)
+    return frame.astype(COMPLETION_DTYPES)
+
+# Save inputs and outputs as parquet, outputs are stored as typed columns prefixed with output_col
+# (output_content, output_prompt_tokens, ..., the inputs have a prompt_tokens column of their own)
+def export_outputs(df, path, output_col = "output"):
+    if output_col in df.columns:
+        df = df.drop(columns=output_col).join(completions_frame(df[output_col]).add_prefix(output_col + "_"))
+    df.to_parquet(path)
+
+
 # FewShot Examples
 def prep_fs_examples(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence, flag_UA, flag_segmented, base_prompt=""):
     user_assistant = None
@@ -195,95 +252,21 @@ def prep_fs_examples(df, id_col, source_col, paragraph_col, sentence_col, standa
     
 
 
+# Examples are built in one pass over df, see fewshot.example_pairs
 def get_user_assistant_context(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence):
-    user_assistant = []
-    
-    for id in df[id_col].unique():
-        user_content = ""
-        assistant_content = {}
-        row = df[df[id_col] == id]
-
-        for source in row[source_col].unique():
-            user_content += str(row[row[source_col] == source][paragraph_col].values[0]) + " ... "
-            if incl_sentence:
-                assistant_content[source] = {"sentence": str(row[row[source_col] == source][sentence_col].values[0]),
-                                             "term": str(row[row[source_col] == source][standard_col].values[0])}
-            else:
-                assistant_content[source] = {"term": str(row[row[source_col] == source][standard_col].values[0])}
-
-        user_assistant.append((user_content, json.dumps(assistant_content)))
-        
-    return user_assistant
+    return fewshot.example_pairs(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence, False)
 
 def get_user_assistant_context_segmented(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence):
-    user_assistant = []
-
-    for i, row in enumerate(df.index):
-        paragraph = df.loc[row, paragraph_col]
-        source = df.loc[row, source_col]
-        sentence_std = df.loc[row, sentence_col]
-        standard_std = df.loc[row, standard_col]
-        
-        assistant_content = {} 
-
-        if incl_sentence:
-            assistant_content[source] = {"sentence": sentence_std,
-                                         "term": standard_std}
-        else:
-            assistant_content[source] = {"term": standard_std}
-
-        user_assistant.append((paragraph, json.dumps(assistant_content)))
-
-    return user_assistant
+    return fewshot.example_pairs(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence, True)
 
 
 def get_examples_prompt(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence, base):
-
-    examples = base
-
-    for i, id in enumerate(df[id_col].unique()):
-        examples += "\nExample " + str(i) + ":\n"
-        paragraph = ""
-        sentence_std = {}
-        row = df[df[id_col] == id]
-
-        for source in row[source_col].unique():            
-            paragraph += str(row[row[source_col] == source][paragraph_col].values[0]) + " ... "
-            if incl_sentence:
-                sentence_std[source] = {"sentence": str(row[row[source_col] == source][sentence_col].values[0]),
-                                        "term": str(row[row[source_col] == source][standard_col].values[0])}
-            else:
-                sentence_std[source] = {"term": str(row[row[source_col] == source][standard_col].values[0])}
-        
-        examples += paragraph + "\nAnswer " + str(i) + ":\n"
-        examples += json.dumps(sentence_std) + '\n'
-
-    return examples
+    pairs = fewshot.example_pairs(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence, False)
+    return fewshot.render_examples(pairs, base)
 
 def get_examples_prompt_segmented(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence, base):
-
-    examples = base
-
-    for i, row in enumerate(df.index):
-        
-        examples += "\nExample " + str(i) + ":\n"
-        
-        paragraph = df.loc[row, paragraph_col]
-
-        source = df.loc[row, source_col]
-        sentence_std = df.loc[row, sentence_col]
-        standard_std = df.loc[row, standard_col]
-
-        if incl_sentence:
-            sentence_std = {source: {"sentence": sentence_std,
-                                     "term": standard_std}}
-        else:
-            sentence_std = {source: {"term": standard_std}}
-            
-        examples += paragraph + "\nAnswer " + str(i) + ":\n"
-        examples += json.dumps(sentence_std) + '\n'
-
-    return examples
+    pairs = fewshot.example_pairs(df, id_col, source_col, paragraph_col, sentence_col, standard_col, incl_sentence, True)
+    return fewshot.render_examples(pairs, base)
 
 
 